@@ -1,4 +1,14 @@
-from .field import field  # noqa: F401
+from .field import field, through_field  # noqa: F401
 from .query import query  # noqa: F401
 from .resolver import resolver_hints  # noqa: F401
 from .types import OptimizedDjangoObjectType  # noqa: F401
+from .registry import register_heavy_fields, register_reference_model  # noqa: F401
+from .pagination import KeysetConnectionField  # noqa: F401
+from .statistics import PlannerStatistics  # noqa: F401
+from .coalesce import PrefetchCoordinator  # noqa: F401
+from .identity import IdentityMap  # noqa: F401
+from .profiling import MemoryProfiler  # noqa: F401
+from .tracing import QueryTracer  # noqa: F401
+from .middleware import OptimizerMiddleware  # noqa: F401
+from .hints import OptimizedPrefetch  # noqa: F401
+from .persisted import CompiledPlans  # noqa: F401
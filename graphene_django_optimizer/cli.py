@@ -0,0 +1,25 @@
+import sys
+
+from . import lint, persisted
+
+COMMANDS = {
+    "lint": lint.main,
+    "compile-plans": persisted.main,
+    "check-plans": persisted.main,
+}
+
+
+def main(argv=None):
+    """
+    Run a command of `python -m graphene_django_optimizer`.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv)
+    print(
+        "usage: python -m graphene_django_optimizer {{{}}} ...".format(
+            ",".join(COMMANDS)
+        ),
+        file=sys.stderr,
+    )
+    return 2
@@ -0,0 +1,168 @@
+import sys
+
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+
+
+class PrefetchCoordinator(object):
+    """
+    Request-scoped cache of the rows prefetched for the root querysets.
+
+    When several root fields select the same relation with the same
+    prefetch queryset, only the objects whose related rows were not loaded
+    yet are prefetched, and the rest reuse the rows of the previous fields.
+    Related instances are shared between those fields, so a coordinator
+    must not outlive its request.
+    """
+
+    def __init__(self):
+        self._rows = {}
+
+    def coordinate(self, queryset):
+        """
+        Return a copy of the queryset whose prefetches of many-valued
+        relations are done through the coordinator.
+        """
+        if not issubclass(queryset._iterable_class, ModelIterable):
+            return queryset
+        coordinated = []
+        remaining = []
+        for lookup in queryset._prefetch_related_lookups:
+            prefetch = lookup if isinstance(lookup, Prefetch) else Prefetch(lookup)
+            key = _get_prefetch_key(queryset.model, prefetch)
+            if key is None:
+                remaining.append(lookup)
+            else:
+                coordinated.append((key, prefetch))
+        if not coordinated:
+            return queryset
+        queryset = queryset.prefetch_related(None).prefetch_related(*remaining)
+        queryset._iterable_class = type(
+            "CoordinatedModelIterable",
+            (CoordinatedModelIterable, queryset._iterable_class),
+            {"coordinator": self, "prefetches": tuple(coordinated)},
+        )
+        return queryset
+
+    def prefetch(self, instances, key, prefetch):
+        rows = self._rows.setdefault(key, {})
+        missing = []
+        for instance in instances:
+            if instance.pk in rows:
+                _set_prefetched_rows(instance, prefetch, rows[instance.pk])
+            else:
+                missing.append(instance)
+        if not missing:
+            return
+        prefetch_related_objects(missing, prefetch)
+        for instance in missing:
+            rows[instance.pk] = _get_prefetched_rows(instance, prefetch)
+
+
+class CoordinatedModelIterable(ModelIterable):
+    """
+    Iterable that prefetches the coordinated relations once every object
+    has been loaded.
+    """
+
+    coordinator = None
+    prefetches = ()
+
+    def __iter__(self):
+        instances = list(super(CoordinatedModelIterable, self).__iter__())
+        for key, prefetch in self.prefetches:
+            self.coordinator.prefetch(instances, key, prefetch)
+        return iter(instances)
+
+
+def _get_prefetch_key(model, prefetch):
+    # Only direct many-valued relations are coordinated, and two prefetches
+    # are identical when they load the same rows into the same attribute.
+    name = prefetch.prefetch_through
+    if LOOKUP_SEP in name:
+        return None
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if not (field.one_to_many or field.many_to_many):
+        return None
+    queryset_key = _get_queryset_key(prefetch.queryset)
+    if queryset_key is False:
+        return None
+    return model._meta.concrete_model, name, prefetch.to_attr, queryset_key
+
+
+def _get_queryset_key(queryset):
+    if queryset is None:
+        return None
+    lookup_keys = []
+    for lookup in queryset._prefetch_related_lookups:
+        if isinstance(lookup, Prefetch):
+            lookup_key = _get_queryset_key(lookup.queryset)
+            if lookup_key is False:
+                return False
+            lookup = (lookup.prefetch_through, lookup.to_attr, lookup_key)
+        lookup_keys.append(lookup)
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return False
+    return (
+        queryset._db,
+        _get_iterable_key(queryset._iterable_class),
+        sql,
+        tuple(repr(param) for param in params),
+        tuple(lookup_keys),
+    )
+
+
+def _get_iterable_key(iterable_class):
+    # The classes created for each queryset, like the ones of the identity
+    # map or the tracer, are keyed by the classes they extend and by the
+    # related objects they attach.
+    classes = tuple(
+        cls
+        for cls in iterable_class.__mro__
+        if getattr(sys.modules.get(cls.__module__), cls.__qualname__, None) is cls
+    )
+    return (
+        classes,
+        getattr(iterable_class, "reference_lookups", ()),
+        getattr(iterable_class, "stub_lookups", ()),
+    )
+
+
+def _get_cache_name(manager):
+    # Many-to-many managers name their prefetch cache, reverse foreign key
+    # managers use the cache name of the relation.
+    cache_name = getattr(manager, "prefetch_cache_name", None)
+    if cache_name is None:
+        cache_name = manager.field.remote_field.get_cache_name()
+    return cache_name
+
+
+def _get_prefetched_rows(instance, prefetch):
+    if prefetch.to_attr:
+        return getattr(instance, prefetch.to_attr)
+    manager = getattr(instance, prefetch.prefetch_through)
+    return list(instance._prefetched_objects_cache[_get_cache_name(manager)])
+
+
+def _set_prefetched_rows(instance, prefetch, rows):
+    # Same as Django's prefetch_one_level for many-valued relations.
+    if prefetch.to_attr:
+        setattr(instance, prefetch.to_attr, list(rows))
+        return
+    manager = getattr(instance, prefetch.prefetch_through)
+    if prefetch.queryset is not None:
+        queryset = manager._apply_rel_filters(prefetch.queryset)
+    else:
+        queryset = manager.get_queryset()
+    queryset._result_cache = list(rows)
+    queryset._prefetch_done = True
+    if not hasattr(instance, "_prefetched_objects_cache"):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[_get_cache_name(manager)] = queryset
@@ -1,8 +1,10 @@
 import types
 from graphene.types.field import Field
+from graphene.types.structures import List
 from graphene.types.unmountedtype import UnmountedType
 
-from .hints import OptimizationHints
+from .hints import OptimizationHints, resolve_ordered_prefetch
+from .utils import get_through_relation
 
 
 def field(field_type, *args, **kwargs):
@@ -14,8 +16,29 @@ def field(field_type, *args, **kwargs):
 
     def get_optimized_resolver(self, parent_resolver):
         resolver = wrap_resolve(parent_resolver)
+        if optimization_hints.ordering is not None:
+            resolver = resolve_ordered_prefetch(resolver)
         resolver.optimization_hints = optimization_hints
         return resolver
 
     field_type.wrap_resolve = types.MethodType(get_optimized_resolver, field_type)
     return field_type
+
+
+def through_field(through_type, model_field, *args, **kwargs):
+    """
+    List of the rows of the custom through model of the many to many field
+    `model_field`, with the attributes of each relation. The optimizer
+    prefetches them with the related objects they point to.
+    """
+
+    def resolve_through(root, info, **field_args):
+        _, _, accessor = get_through_relation(root._meta.get_field(model_field))
+        return getattr(root, accessor).all()
+
+    return field(
+        List(through_type, resolver=resolve_through),
+        *args,
+        model_field=model_field,
+        **kwargs
+    )
@@ -0,0 +1,77 @@
+from functools import partial
+
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.filter.fields import DjangoFilterConnectionField
+
+
+class OptimizedDjangoFilterConnectionField(DjangoFilterConnectionField):
+    """
+    DjangoFilterConnectionField that can be prefetched when it is nested.
+
+    The optimizer runs the filterset of the field against the arguments of
+    the selection and prefetches only the matching rows, which are then used
+    by the resolver instead of filtering the relation again for each object.
+    Requires django-filter.
+    """
+
+    @classmethod
+    def get_prefetch_to_attr(cls, response_key):
+        return "gql_filtered_" + response_key
+
+    @classmethod
+    def filter_prefetch_queryset(cls, resolver, queryset, args, context):
+        """
+        Return the queryset filtered by the filterset of the field, or None
+        if the arguments are not valid.
+        """
+        for resolver_arg in resolver.args:
+            if (
+                isinstance(resolver_arg, partial)
+                and "filterset_class" in resolver_arg.keywords
+            ):
+                filterset_class = resolver_arg.keywords["filterset_class"]
+                filtering_args = resolver_arg.keywords["filtering_args"]
+                break
+        else:
+            return None
+        data = {}
+        for key, value in args.items():
+            if key in filtering_args:
+                if key == "order_by" and value is not None:
+                    value = to_snake_case(value)
+                data[key] = value
+        filterset = filterset_class(data=data, queryset=queryset, request=context)
+        if not filterset.form.is_valid():
+            return None
+        return filterset.qs
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args
+    ):
+        to_attr = cls.get_prefetch_to_attr(info.path.key)
+        if hasattr(root, to_attr):
+            # The rows were already filtered and prefetched by the optimizer.
+            prefetched = getattr(root, to_attr)
+            resolver = lambda *args, **kwargs: prefetched
+            queryset_resolver = lambda connection, iterable, info, args: iterable
+        return super(OptimizedDjangoFilterConnectionField, cls).connection_resolver(
+            resolver,
+            connection,
+            default_manager,
+            queryset_resolver,
+            max_limit,
+            enforce_first_or_last,
+            root,
+            info,
+            **args
+        )
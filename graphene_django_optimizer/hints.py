@@ -1,4 +1,17 @@
-from .utils import is_iterable, noop
+import copy
+import functools
+import threading
+from collections import OrderedDict
+
+from django.db.models import Prefetch
+from django.db.models.query import QuerySet
+from graphql import print_ast
+from graphql.language.visitor import Visitor, visit
+
+from .utils import is_iterable, is_optimized, noop
+
+# Maximum number of results kept for each pure hint.
+PURE_HINT_CACHE_SIZE = 256
 
 
 def _normalize_model_field(value):
@@ -17,6 +30,133 @@ def _normalize_hint_value(value):
     return value
 
 
+class _SelectionDependencies(Visitor):
+    def __init__(self):
+        super(_SelectionDependencies, self).__init__()
+        self.fragment_names = []
+        self.variable_names = set()
+
+    def enter_fragment_spread(self, node, *_args):
+        if node.name.value not in self.fragment_names:
+            self.fragment_names.append(node.name.value)
+
+    def enter_variable(self, node, *_args):
+        self.variable_names.add(node.name.value)
+
+
+def _get_selection_key(info):
+    """
+    Return a hashable key for the sub-selection of the field being resolved,
+    including the fragments and variable values that it uses.
+    """
+    dependencies = _SelectionDependencies()
+    for field_node in info.field_nodes:
+        visit(field_node, dependencies)
+    fragments = []
+    for name in dependencies.fragment_names:
+        fragment = info.fragments[name]
+        visit(fragment, dependencies)
+        fragments.append(print_ast(fragment))
+    variables = tuple(
+        (name, repr(info.variable_values.get(name)))
+        for name in sorted(dependencies.variable_names)
+    )
+    field_nodes = tuple(print_ast(field_node) for field_node in info.field_nodes)
+    return field_nodes, tuple(fragments), variables
+
+
+def _clone_hint_value(value):
+    if isinstance(value, Prefetch):
+        value = copy.copy(value)
+        if value.queryset is not None:
+            value.queryset = _clone_hint_value(value.queryset)
+        return value
+    if isinstance(value, QuerySet):
+        value = value.all()
+        value._prefetch_related_lookups = tuple(
+            _clone_hint_value(lookup) for lookup in value._prefetch_related_lookups
+        )
+        return value
+    if is_iterable(value):
+        return tuple(_clone_hint_value(item) for item in value)
+    return value
+
+
+def _contains_optimized_queryset(value):
+    if isinstance(value, Prefetch):
+        value = value.queryset
+    if isinstance(value, QuerySet):
+        return is_optimized(value) or any(
+            _contains_optimized_queryset(lookup)
+            for lookup in value._prefetch_related_lookups
+        )
+    if is_iterable(value):
+        return any(_contains_optimized_queryset(item) for item in value)
+    return False
+
+
+def _memoize_hint_value(value):
+    """
+    Cache the results of a hint that only depends on its GraphQL arguments
+    and sub-selection. Cached results are cloned before being returned, so
+    the optimizer can mutate them. Querysets optimized with `query` carry
+    the options of their request, so they can't be cached.
+    """
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def memoized_value(info, *args):
+        key = (repr(args), _get_selection_key(info))
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return _clone_hint_value(cache[key])
+        result = value(info, *args)
+        if _contains_optimized_queryset(result):
+            raise ValueError(
+                "Pure hints can't return querysets optimized with query(), "
+                "as they depend on the request."
+            )
+        with lock:
+            cache[key] = result
+            while len(cache) > PURE_HINT_CACHE_SIZE:
+                cache.popitem(last=False)
+        return _clone_hint_value(result)
+
+    return memoized_value
+
+
+def get_ordered_prefetch_to_attr(response_key):
+    return "gql_ordered_" + response_key
+
+
+def resolve_ordered_prefetch(resolver):
+    """
+    Wrap the resolver of a field with an ordering hint, so it returns the
+    rows prefetched for it by the optimizer when there are any.
+    """
+
+    @functools.wraps(resolver)
+    def resolve(root, info, **args):
+        to_attr = get_ordered_prefetch_to_attr(info.path.key)
+        if hasattr(root, to_attr):
+            return getattr(root, to_attr)
+        return resolver(root, info, **args)
+
+    return resolve
+
+
+class OptimizedPrefetch(Prefetch):
+    """
+    Prefetch returned by a `prefetch_related` hint whose queryset is
+    optimized with the sub-selection of the hinted field, in the same pass
+    as the rest of the query.
+
+    The queryset is the base queryset of the relation, like a filtered one,
+    and defaults to all the related rows.
+    """
+
+
 class OptimizationHints(object):
     def __init__(
         self,
@@ -24,8 +164,32 @@ class OptimizationHints(object):
         select_related=noop,
         prefetch_related=noop,
         only=noop,
+        infer=True,
+        pure=False,
+        ordering=None,
     ):
         self.model_field = _normalize_model_field(model_field)
         self.prefetch_related = _normalize_hint_value(prefetch_related)
         self.select_related = _normalize_hint_value(select_related)
         self.only = _normalize_hint_value(only)
+        # None keeps the ordering of the prefetched relation, an empty
+        # ordering removes it.
+        self.ordering = None if ordering is None else _normalize_hint_value(ordering)
+        self.infer = infer
+        self.is_empty = (
+            model_field is None
+            and ordering is None
+            and all(value is noop for value in (select_related, prefetch_related, only))
+        )
+        # Static and pure hints only depend on the document, so their
+        # results can be compiled.
+        self.is_static = pure or not any(
+            callable(value) and value is not noop
+            for value in (select_related, prefetch_related, only, ordering)
+        )
+        if pure:
+            self.prefetch_related = _memoize_hint_value(self.prefetch_related)
+            self.select_related = _memoize_hint_value(self.select_related)
+            self.only = _memoize_hint_value(self.only)
+            if self.ordering is not None:
+                self.ordering = _memoize_hint_value(self.ordering)
@@ -0,0 +1,134 @@
+from django.db.models import Prefetch
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.fields.related_descriptors import ManyToManyDescriptor
+from django.db.models.query import ModelIterable
+
+
+class IdentityMap(object):
+    """
+    Request-scoped map of the model instances loaded by the optimized
+    querysets, keyed by (model, pk).
+
+    A row loaded again returns the instance that was loaded first, with the
+    columns and related objects of both loads. Foreign keys to rows that
+    are already in the map are resolved without a query.
+    """
+
+    def __init__(self):
+        self._instances = {}
+
+    def get(self, model, pk):
+        return self._instances.get((model, pk))
+
+    def add(self, instance, prefetched=()):
+        """
+        Return the instance of the map for the row of `instance`. The
+        relations in `prefetched` are about to be prefetched again for it.
+        """
+        key = (type(instance), instance.pk)
+        existing = self._instances.get(key)
+        if existing is None:
+            self._instances[key] = instance
+            return instance
+        if existing is not instance:
+            _merge_instance(existing, instance, prefetched)
+        return existing
+
+    def attach(self, queryset):
+        """
+        Return a copy of the queryset whose instances, and the ones joined
+        with select_related, go through the map.
+        """
+        if not issubclass(queryset._iterable_class, ModelIterable):
+            return queryset
+        if issubclass(queryset._iterable_class, IdentityMapModelIterable):
+            # Like the prefetch querysets optimized by their own hint.
+            return queryset
+        queryset = queryset.all()
+        queryset._iterable_class = type(
+            "IdentityMapModelIterable",
+            (IdentityMapModelIterable, queryset._iterable_class),
+            {"identity_map": self},
+        )
+        return queryset
+
+
+class IdentityMapModelIterable(ModelIterable):
+    """
+    Iterable that replaces the loaded instances by the ones of an identity map.
+    """
+
+    identity_map = None
+
+    def __iter__(self):
+        select_related = self.queryset.query.select_related
+        if not isinstance(select_related, dict):
+            select_related = {}
+        prefetched = {
+            _get_lookup_name(lookup)
+            for lookup in self.queryset._prefetch_related_lookups
+        }
+        for obj in super(IdentityMapModelIterable, self).__iter__():
+            yield _add_tree(self.identity_map, obj, select_related, prefetched)
+
+
+def _get_lookup_name(lookup):
+    if isinstance(lookup, Prefetch):
+        lookup = lookup.prefetch_through
+    return lookup.split(LOOKUP_SEP)[0]
+
+
+def _get_cache_name(model, name):
+    # Many-to-many managers name their cache, the others use the name of
+    # the relation.
+    descriptor = getattr(model, name, None)
+    if isinstance(descriptor, ManyToManyDescriptor):
+        if descriptor.reverse:
+            return descriptor.field.related_query_name()
+        return descriptor.field.name
+    return name
+
+
+def _add_tree(identity_map, obj, select_related, prefetched=()):
+    for name, nested in select_related.items():
+        field = obj._meta.get_field(name)
+        if field.is_cached(obj):
+            related_obj = field.get_cached_value(obj)
+            if related_obj is not None:
+                related_obj = _add_tree(identity_map, related_obj, nested)
+                field.set_cached_value(obj, related_obj)
+    obj = identity_map.add(obj, prefetched)
+    for field in obj._meta.concrete_fields:
+        if not field.many_to_one and not field.one_to_one:
+            continue
+        if field.is_cached(obj) or not field.target_field.primary_key:
+            continue
+        # Deferred foreign keys are not loaded to be looked up.
+        value = obj.__dict__.get(field.attname)
+        if value is not None:
+            related_obj = identity_map.get(field.related_model, value)
+            if related_obj is not None:
+                field.set_cached_value(obj, related_obj)
+    return obj
+
+
+def _merge_instance(instance, duplicate, prefetched=()):
+    # Columns deferred in the first load but loaded now are kept.
+    for name, value in duplicate.__dict__.items():
+        if name not in ("_state", "_prefetched_objects_cache"):
+            instance.__dict__.setdefault(name, value)
+    for name, value in duplicate._state.fields_cache.items():
+        instance._state.fields_cache.setdefault(name, value)
+    # The prefetches of the new queryset may load other columns, so they
+    # are done again instead of reusing the previous ones. The cache itself
+    # is kept, as Django may be prefetching into it, like when a relation
+    # loads rows of the level that is being prefetched.
+    cache = instance.__dict__.get("_prefetched_objects_cache")
+    if cache:
+        for name in prefetched:
+            cache.pop(_get_cache_name(type(instance), name), None)
+    duplicate_cache = duplicate.__dict__.get("_prefetched_objects_cache")
+    if duplicate_cache:
+        cache = instance.__dict__.setdefault("_prefetched_objects_cache", {})
+        for name, value in duplicate_cache.items():
+            cache.setdefault(name, value)
@@ -0,0 +1,217 @@
+import ast
+import functools
+import inspect
+import textwrap
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.constants import LOOKUP_SEP
+
+from .hints import OptimizationHints
+from .registry import get_heavy_fields, get_registry_version
+
+
+class InferenceError(Exception):
+    pass
+
+
+def infer_optimization_hints(model, name):
+    """
+    Infer the optimization hints of a model property or method.
+
+    The source of the attribute is parsed once, or again after the registry
+    changes, and every access to `self` is followed to find the columns,
+    joins and prefetches that it needs.
+    Returns None when the attribute can't be analyzed.
+    """
+    return _infer_optimization_hints(model, name, get_registry_version())
+
+
+@functools.lru_cache(maxsize=None)
+def _infer_optimization_hints(model, name, registry_version):
+    attribute = inspect.getattr_static(model, name, None)
+    if not _is_inferable(attribute):
+        return None
+    dependencies = _Dependencies()
+    try:
+        function = _get_function_node(attribute)
+        alias = _get_relation_alias(model, function)
+        if alias:
+            return OptimizationHints(model_field=alias)
+        dependencies.add_function(model, function, "", frozenset((name,)))
+    except InferenceError:
+        return None
+    return OptimizationHints(
+        select_related=tuple(dependencies.select_list),
+        prefetch_related=tuple(dependencies.prefetch_list),
+        only=tuple(dependencies.only_list),
+    )
+
+
+def infer_resolver_relations(model, resolver):
+    """
+    Return the (select_related, prefetch_related) lookups used through the
+    first argument of a resolver function, or None if it can't be analyzed.
+    """
+    dependencies = _Dependencies()
+    try:
+        dependencies.add_function(model, _get_function_node(resolver), "", frozenset())
+    except InferenceError:
+        return None
+    return tuple(dependencies.select_list), tuple(dependencies.prefetch_list)
+
+
+def _is_inferable(attribute):
+    return isinstance(attribute, property) or inspect.isfunction(attribute)
+
+
+def _get_function_node(attribute):
+    if isinstance(attribute, property):
+        attribute = attribute.fget
+    try:
+        source = textwrap.dedent(inspect.getsource(attribute))
+    except (OSError, TypeError):
+        raise InferenceError("Source code is not available")
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.FunctionDef):
+            return node
+    raise InferenceError("Function definition not found")
+
+
+def _get_self_name(function):
+    args = function.args.args
+    if not args:
+        raise InferenceError("Function has no self argument")
+    return args[0].arg
+
+
+def _get_relation_alias(model, function):
+    """
+    Return the relation name when the function body is just
+    `return self.<relation>` or `return self.<relation>.all()`.
+    """
+    body = [
+        node
+        for node in function.body
+        if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant))
+    ]
+    if len(body) != 1 or not isinstance(body[0], ast.Return):
+        return None
+    value = body[0].value
+    if (
+        isinstance(value, ast.Call)
+        and not value.args
+        and not value.keywords
+        and isinstance(value.func, ast.Attribute)
+        and value.func.attr == "all"
+    ):
+        value = value.func.value
+    if not (
+        isinstance(value, ast.Attribute)
+        and isinstance(value.value, ast.Name)
+        and value.value.id == _get_self_name(function)
+    ):
+        return None
+    model_field = _get_model_field(model, value.attr)
+    if model_field and model_field.is_relation:
+        return value.attr
+    return None
+
+
+def _get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        for field in model._meta.concrete_fields:
+            if field.attname == name:
+                return field
+        return None
+
+
+def _get_attribute_chain(node, self_name):
+    """
+    Return the attribute names accessed from `self` by the outermost
+    attribute node of a chain, like ["parent", "name"] for `self.parent.name`.
+    """
+    chain = []
+    while isinstance(node, ast.Attribute):
+        chain.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name) or node.id != self_name:
+        return None
+    chain.reverse()
+    return chain
+
+
+class _Dependencies(object):
+    def __init__(self):
+        self.select_list = []
+        self.prefetch_list = []
+        self.only_list = []
+
+    def _add(self, target, value):
+        if value not in target:
+            target.append(value)
+
+    def add_function(self, model, function, prefix, visited):
+        self_name = _get_self_name(function)
+        parents = {}
+        for node in ast.walk(function):
+            for child in ast.iter_child_nodes(node):
+                parents[child] = node
+        for node in ast.walk(function):
+            if not isinstance(node, ast.Name) or node.id != self_name:
+                continue
+            # Find the outermost attribute node of the chain.
+            outer = node
+            while isinstance(parents.get(outer), ast.Attribute):
+                outer = parents[outer]
+            if outer is node:
+                # `self` is used as a value, so anything could be accessed.
+                raise InferenceError("self is used outside an attribute access")
+            chain = _get_attribute_chain(outer, self_name)
+            if chain is None:
+                raise InferenceError("Unsupported attribute access")
+            self.add_chain(model, chain, prefix, visited)
+
+    def add_chain(self, model, chain, prefix, visited):
+        name = chain[0]
+        rest = chain[1:]
+        if name == "pk":
+            self._add(self.only_list, prefix + model._meta.pk.name)
+            return
+        model_field = _get_model_field(model, name)
+        if model_field is None:
+            self.add_attribute(model, name, prefix, visited)
+        elif not model_field.is_relation or model_field.name != name:
+            # A plain column or the column of a foreign key (e.g. parent_id).
+            self._add(self.only_list, prefix + name)
+        elif model_field.many_to_one or model_field.one_to_one:
+            self.add_select_related(model_field, rest, prefix)
+        else:
+            if rest[:1] and rest != ["all"]:
+                raise InferenceError("Related manager is not used with .all()")
+            self._add(self.prefetch_list, prefix + name)
+
+    def add_select_related(self, model_field, rest, prefix):
+        related_model = model_field.related_model
+        lookup = prefix + model_field.name
+        self._add(self.select_list, lookup)
+        if rest:
+            self.add_chain(related_model, rest, lookup + LOOKUP_SEP, frozenset())
+            return
+        # The related instance is used as a value, so load all its columns.
+        heavy_fields = get_heavy_fields(related_model)
+        for field in related_model._meta.local_concrete_fields:
+            if field.name not in heavy_fields:
+                self._add(self.only_list, lookup + LOOKUP_SEP + field.name)
+
+    def add_attribute(self, model, name, prefix, visited):
+        attribute = inspect.getattr_static(model, name, None)
+        if _is_inferable(attribute):
+            # Values returned by properties and methods are analyzed in
+            # their own body, so attributes of the result are safe.
+            if name not in visited:
+                function = _get_function_node(attribute)
+                self.add_function(model, function, prefix, visited | {name})
+        elif attribute is None or hasattr(attribute, "__get__"):
+            raise InferenceError("Unsupported attribute {}".format(name))
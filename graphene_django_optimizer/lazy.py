@@ -0,0 +1,33 @@
+from django.db.models.query import ModelIterable
+
+
+def defer_optimization(queryset, optimize):
+    """
+    Return a copy of the queryset that is passed to `optimize` when it is
+    evaluated, after any filter, ordering or slicing applied to it. Counts
+    and existence checks don't optimize it.
+    """
+    queryset = queryset.all()
+    queryset._iterable_class = type(
+        "LazyOptimizedModelIterable",
+        (LazyOptimizedModelIterable, queryset._iterable_class),
+        {"optimize": staticmethod(optimize), "base_class": queryset._iterable_class},
+    )
+    return queryset
+
+
+class LazyOptimizedModelIterable(ModelIterable):
+    """
+    Iterable that loads the instances of the optimized queryset.
+    """
+
+    optimize = None
+    base_class = ModelIterable
+
+    def __iter__(self):
+        queryset = self.queryset._chain()
+        queryset._iterable_class = self.base_class
+        instances = list(self.optimize(queryset))
+        # The optimized queryset also ran the prefetches of the original one.
+        self.queryset._prefetch_done = True
+        return iter(instances)
@@ -0,0 +1,146 @@
+import argparse
+import functools
+import inspect
+import sys
+from collections import namedtuple
+from types import SimpleNamespace
+
+import django
+from django.utils.module_loading import import_string
+from graphene_django import DjangoObjectType
+from graphql import GraphQLInterfaceType, GraphQLObjectType, GraphQLUnionType
+
+from .inference import infer_optimization_hints, infer_resolver_relations
+from .query import QueryOptimizer
+
+ABORT_ONLY = "abort-only"
+UNHINTED_RELATIONS = "unhinted-relations"
+NO_BASE_MODEL = "no-base-model"
+
+LintWarning = namedtuple("LintWarning", ("type_name", "field_name", "code", "message"))
+
+
+def lint_schema(schema):
+    """
+    Return the warnings of the fields and abstract types of a schema that
+    the optimizer can't optimize.
+    """
+    optimizer = QueryOptimizer(SimpleNamespace(schema=schema, context=None))
+    graphql_schema = optimizer.graphql_schema
+    warnings = []
+    for type_name, graphql_type in sorted(graphql_schema.type_map.items()):
+        if type_name.startswith("__"):
+            continue
+        graphene_type = getattr(graphql_type, "graphene_type", None)
+        if isinstance(graphql_type, (GraphQLInterfaceType, GraphQLUnionType)):
+            warnings += _lint_abstract_type(optimizer, type_name, graphql_type)
+        elif (
+            isinstance(graphql_type, GraphQLObjectType)
+            and inspect.isclass(graphene_type)
+            and issubclass(graphene_type, DjangoObjectType)
+        ):
+            model = graphene_type._meta.model
+            for field_name, field_def in graphql_type.fields.items():
+                warnings += _lint_field(
+                    optimizer, model, type_name, field_name, field_def
+                )
+    return warnings
+
+
+def _lint_abstract_type(optimizer, type_name, graphql_type):
+    possible_types = optimizer._get_possible_types(graphql_type)
+    models = [
+        getattr(getattr(t.graphene_type, "_meta", None), "model", None)
+        for t in possible_types
+    ]
+    if not any(models) or optimizer._get_base_model(possible_types):
+        return []
+    return [
+        LintWarning(
+            type_name,
+            None,
+            NO_BASE_MODEL,
+            "the possible types don't share a model, so fragments on them "
+            "are not optimized",
+        )
+    ]
+
+
+def _lint_field(optimizer, model, type_name, field_name, field_def):
+    resolver = field_def.resolve
+    hints = optimizer._get_optimization_hints(resolver)
+    if hints and not (hints.is_empty and not hints.infer):
+        return []
+    name = optimizer._get_name_from_resolver(resolver)
+    if isinstance(name, str):
+        if optimizer._get_model_field_from_name(model, name):
+            return []
+        if not hints and infer_optimization_hints(model, name):
+            return []
+    warnings = [
+        LintWarning(
+            type_name,
+            field_name,
+            ABORT_ONLY,
+            "no model field nor hints, so the only() optimization of {} "
+            "is aborted".format(model.__name__),
+        )
+    ]
+    function = _get_resolver_function(resolver)
+    if not function or optimizer._get_optimization_hints(function):
+        return warnings
+    relations = infer_resolver_relations(model, function)
+    if relations and any(relations):
+        lookups = ", ".join(lookup for lookups in relations for lookup in lookups)
+        warnings.append(
+            LintWarning(
+                type_name,
+                field_name,
+                UNHINTED_RELATIONS,
+                "the resolver uses {} without hints, which causes "
+                "N+1 queries".format(lookups),
+            )
+        )
+    return warnings
+
+
+def _get_resolver_function(resolver):
+    while isinstance(resolver, functools.partial):
+        functions = [arg for arg in resolver.args if inspect.isfunction(arg)]
+        if not functions:
+            return None
+        resolver = functions[0]
+    if inspect.ismethod(resolver):
+        resolver = resolver.__func__
+    return resolver if inspect.isfunction(resolver) else None
+
+
+def format_warning(warning):
+    location = warning.type_name
+    if warning.field_name:
+        location += "." + warning.field_name
+    return "{}: {} ({})".format(location, warning.message, warning.code)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m graphene_django_optimizer")
+    subparsers = parser.add_subparsers(dest="command")
+    lint_parser = subparsers.add_parser(
+        "lint", help="report the fields of a schema that can't be optimized"
+    )
+    lint_parser.add_argument(
+        "schema", help="dotted path of the schema, like myproject.schema.schema"
+    )
+    args = parser.parse_args(argv)
+    if args.command != "lint":
+        parser.print_help()
+        return 2
+
+    django.setup()
+    warnings = lint_schema(import_string(args.schema))
+    for warning in warnings:
+        print(format_warning(warning))
+    if warnings:
+        print("{} warning(s)".format(len(warnings)), file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,80 @@
+from functools import partial
+
+from django.db.models import Model, QuerySet
+from django.db.models.query import ModelIterable
+from graphene.relay import Connection
+from graphene_django import DjangoConnectionField, DjangoObjectType
+from graphql import GraphQLObjectType, get_named_type, is_composite_type
+
+from .query import query
+from .utils import is_optimized
+
+
+class OptimizerMiddleware(object):
+    """
+    Graphene middleware that optimizes the querysets returned by the
+    resolvers of list and connection fields of Django types that don't call
+    `query`.
+
+    Fields of model instances are skipped, as they are optimized with their
+    parent. It must be the first middleware of the list, which is the one
+    that calls the resolver, so connection fields can be optimized before
+    they are sliced.
+
+    Arguments:
+        - **options - options passed to `query`.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def resolve(self, next, root, info, **args):
+        if isinstance(root, Model) or not _is_optimizable_type(info.return_type):
+            return next(root, info, **args)
+        if _is_connection_resolver(next):
+            # The queryset of a connection is sliced inside the resolver, so
+            # it is optimized when it is resolved.
+            resolver_args = list(next.args)
+            resolver_args[3] = partial(self._resolve_queryset, resolver_args[3])
+            next = partial(next.func, *resolver_args, **next.keywords)
+            return next(root, info, **args)
+        return self.optimize(next(root, info, **args), info)
+
+    def optimize(self, result, info):
+        if (
+            isinstance(result, QuerySet)
+            and result._result_cache is None
+            and issubclass(result._iterable_class, ModelIterable)
+            and not is_optimized(result)
+        ):
+            result = query(result, info, **self.options)
+        return result
+
+    def _resolve_queryset(self, queryset_resolver, connection, iterable, info, args):
+        return self.optimize(queryset_resolver(connection, iterable, info, args), info)
+
+
+def _is_connection_resolver(resolver):
+    func = getattr(resolver, "func", None)
+    owner = getattr(func, "__self__", None)
+    return (
+        isinstance(resolver, partial)
+        and getattr(func, "__name__", None) == "connection_resolver"
+        and isinstance(owner, type)
+        and issubclass(owner, DjangoConnectionField)
+    )
+
+
+def _is_optimizable_type(return_type):
+    named_type = get_named_type(return_type)
+    if not is_composite_type(named_type):
+        return False
+    if not isinstance(named_type, GraphQLObjectType):
+        # Interfaces and unions are optimized through their possible types.
+        return True
+    graphene_type = getattr(named_type, "graphene_type", None)
+    if isinstance(graphene_type, type) and issubclass(graphene_type, Connection):
+        graphene_type = graphene_type._meta.node
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, DjangoObjectType
+    )
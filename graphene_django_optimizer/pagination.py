@@ -0,0 +1,208 @@
+import base64
+import binascii
+import json
+from functools import partial
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import QuerySet
+from graphene.relay.connection import PageInfo
+from graphene_django.fields import DjangoConnectionField
+from graphene_django.utils import maybe_queryset
+
+KEYSET_CURSOR_PREFIX = "keyset:"
+
+
+class KeysetConnectionField(DjangoConnectionField):
+    """
+    Connection field paginated by the values of its ordering keys.
+
+    Cursors encode the ordering key values of an edge, and a page is fetched
+    by filtering on the rows that come after (or before) those values, so
+    the cost of a page doesn't depend on how deep it is.
+
+    The ordering is the `ordering` argument of the field, or else the ordering
+    of the resolved queryset. The primary key is always added as the last
+    key, and every key must be a non-nullable column of the model.
+
+    When paginating forward, `hasPreviousPage` is true whenever an `after`
+    cursor is given, without checking that rows come before it, as the Relay
+    specification allows. The same goes for `hasNextPage` when paginating
+    backward with a `before` cursor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.ordering = tuple(kwargs.pop("ordering", ()))
+        super(KeysetConnectionField, self).__init__(*args, **kwargs)
+        # Keyset cursors replace offsets.
+        self.args.pop("offset", None)
+
+    def get_queryset_resolver(self):
+        return partial(self.resolve_queryset, ordering=self.ordering)
+
+    @classmethod
+    def resolve_queryset(cls, connection, queryset, info, args, ordering=()):
+        queryset = super(KeysetConnectionField, cls).resolve_queryset(
+            connection, queryset, info, args
+        )
+        if ordering and isinstance(queryset, QuerySet):
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        if not isinstance(iterable, QuerySet):
+            return super(KeysetConnectionField, cls).resolve_connection(
+                connection, args, iterable, max_limit
+            )
+
+        keys = get_keyset_keys(iterable)
+        queryset = _load_fields(iterable, [name for name, _ in keys])
+        after = args.get("after")
+        before = args.get("before")
+        if after:
+            queryset = queryset.filter(_get_keyset_filter(keys, after))
+        if before:
+            queryset = queryset.filter(_get_keyset_filter(_reverse_keys(keys), before))
+
+        first = args.get("first")
+        last = args.get("last")
+        if max_limit is not None and first is None and last is None:
+            first = max_limit
+
+        has_previous_page = bool(after)
+        has_next_page = bool(before)
+        if first is None and last is not None:
+            # Fetch the page from the end, in the reverse order.
+            queryset = queryset.order_by(*_get_ordering(_reverse_keys(keys)))
+            nodes = list(queryset[: last + 1])
+            has_previous_page = len(nodes) > last
+            nodes = nodes[:last][::-1]
+        else:
+            queryset = queryset.order_by(*_get_ordering(keys))
+            if first is not None:
+                nodes = list(queryset[: first + 1])
+                has_next_page = len(nodes) > first
+                nodes = nodes[:first]
+            else:
+                nodes = list(queryset)
+            if last is not None and len(nodes) > last:
+                has_previous_page = True
+                nodes = nodes[-last:]
+
+        edges = [
+            connection.Edge(node=node, cursor=_encode_cursor(node, keys))
+            for node in nodes
+        ]
+        page_info = PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        )
+        connection = connection(edges=edges, page_info=page_info)
+        connection.iterable = iterable
+        return connection
+
+
+def get_keyset_keys(queryset):
+    """
+    Return the (field, descending) keys of the ordering of a queryset,
+    ending with the primary key.
+    """
+    opts = queryset.model._meta
+    if queryset.query.order_by:
+        ordering = queryset.query.order_by
+    elif queryset.query.default_ordering:
+        ordering = opts.ordering
+    else:
+        ordering = ()
+
+    keys = []
+    for order in ordering:
+        field = _get_key_field(opts, order)
+        descending = order.startswith("-")
+        if field.name not in [key_name for key_name, _ in keys]:
+            keys.append((field.name, descending))
+    if opts.pk.name not in [name for name, _ in keys]:
+        keys.append((opts.pk.name, False))
+    return keys
+
+
+def _get_key_field(opts, order):
+    field = None
+    if isinstance(order, str) and LOOKUP_SEP not in order:
+        name = order.lstrip("-+")
+        if name == "pk":
+            name = opts.pk.name
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            pass
+    if field is None or not field.concrete:
+        raise ValueError(
+            "Keyset pagination only supports ordering by columns of the model, "
+            "got {!r}".format(order)
+        )
+    if field.null:
+        # Comparisons with NULL never match, so those rows would be skipped.
+        raise ValueError(
+            "Keyset pagination only supports ordering by non-nullable columns, "
+            "got {!r}".format(order)
+        )
+    return field
+
+
+def _reverse_keys(keys):
+    return [(name, not descending) for name, descending in keys]
+
+
+def _get_ordering(keys):
+    return [("-" if descending else "") + name for name, descending in keys]
+
+
+def _get_keyset_filter(keys, cursor):
+    # Rows that come after the cursor in the order of the keys:
+    # (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+    values = _decode_cursor(cursor, len(keys))
+    keyset_filter = Q()
+    for i, (name, descending) in enumerate(keys):
+        lookups = {key_name: values[j] for j, (key_name, _) in enumerate(keys[:i])}
+        lookups[name + ("__lt" if descending else "__gt")] = values[i]
+        keyset_filter |= Q(**lookups)
+    return keyset_filter
+
+
+def _encode_cursor(node, keys):
+    values = [node._meta.get_field(name).value_to_string(node) for name, _ in keys]
+    cursor = KEYSET_CURSOR_PREFIX + json.dumps(values)
+    return base64.b64encode(cursor.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor, length):
+    try:
+        value = base64.b64decode(cursor.encode("ascii")).decode("utf-8")
+        prefix, _, value = value.partition(":")
+        if prefix + ":" != KEYSET_CURSOR_PREFIX:
+            raise ValueError
+        values = json.loads(value)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid keyset cursor {!r}".format(cursor))
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid keyset cursor {!r}".format(cursor))
+    return values
+
+
+def _load_fields(queryset, names):
+    # Make sure the key columns are loaded, even if the optimizer limited
+    # the queryset with "only" or "defer", to build the cursors.
+    field_names, defer = queryset.query.deferred_loading
+    if defer:
+        if field_names.isdisjoint(names):
+            return queryset
+        return queryset.defer(None).defer(*(field_names.difference(names)))
+    if not field_names or field_names.issuperset(names):
+        return queryset
+    return queryset.only(*field_names.union(names))
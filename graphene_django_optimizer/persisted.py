@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import json
+import logging
+import sys
+
+import django
+from django.apps import apps
+from django.db.models import Prefetch
+from django.db.models.query import ModelIterable
+from django.utils.module_loading import import_string
+from graphql import (
+    GraphQLResolveInfo,
+    OperationDefinitionNode,
+    parse,
+    print_schema,
+    validate,
+)
+from graphql.execution.execute import ExecutionContext
+from graphql.pyutils import Path
+from graphql.utilities import get_operation_root_type
+
+from .query import QueryOptimizer
+from .reference import ReferenceModelIterable, get_reference_iterable_class
+from .utils import collect_fields_compat, get_field_def_compat
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+
+
+class CompiledPlans(object):
+    """
+    Plans of the root fields of persisted documents, compiled with
+    `compile_plans`, keyed by the document, the operation and the field.
+
+    Root fields whose plan depends on variables, on non pure hint functions
+    or on filter connections are not compiled, and are optimized as usual.
+    """
+
+    def __init__(self, plans=None):
+        self.plans = {}
+        for key, plan in (plans or {}).items():
+            self.plans[key] = CompiledPlan(plan)
+
+    @classmethod
+    def load(cls, data, schema):
+        """
+        Return the plans of an artifact, or no plans if it doesn't match the
+        schema or the models, so the operations are optimized at runtime.
+        """
+        problems = check_plans(data, schema)
+        if problems:
+            logger.warning(
+                "The compiled plans are ignored: %s. Compile them again.",
+                "; ".join(problems),
+            )
+            return cls()
+        return cls(data["plans"])
+
+    def get_plan(self, info, model):
+        field_node = info.field_nodes[0]
+        if not self.plans or field_node.loc is None:
+            return None
+        key = _get_plan_key(
+            _get_document_hash(field_node.loc.source.body),
+            info.operation,
+            info.path,
+        )
+        plan = self.plans.get(key)
+        if plan is None or plan.model is not model:
+            return None
+        return plan
+
+
+class CompiledPlan(object):
+    def __init__(self, data):
+        self.data = data
+        self.model = apps.get_model(data["model"])
+
+    def apply(self, queryset):
+        return _apply_plan_data(queryset, self.data)
+
+
+def compile_plans(schema, documents):
+    """
+    Return the artifact with the plans of the root fields of `documents`,
+    which is serializable with json.
+    """
+    graphql_schema = getattr(schema, "graphql_schema", schema)
+    plans = {}
+    for document in documents:
+        errors = validate(graphql_schema, parse(document))
+        if errors:
+            raise ValueError(errors[0].message)
+        document_hash = _get_document_hash(document)
+        for info in get_root_resolve_infos(schema, document):
+            optimizer = QueryOptimizer(info)
+            store = optimizer.get_store()
+            if not optimizer.compilable or store.model is None:
+                continue
+            queryset = store.optimize_queryset(store.model.objects.all())
+            plan = _get_plan_data(queryset)
+            if plan is not None:
+                key = _get_plan_key(document_hash, info.operation, info.path)
+                plans[key] = plan
+    return {
+        "version": VERSION,
+        "schema": get_schema_hash(schema),
+        "plans": plans,
+    }
+
+
+def check_plans(data, schema):
+    """
+    Return the reasons why an artifact doesn't match the schema or models.
+    """
+    if data.get("version") != VERSION:
+        return ["the artifact version is not {}".format(VERSION)]
+    problems = []
+    if data["schema"] != get_schema_hash(schema):
+        problems.append("the schema changed")
+    labels = set()
+    pending = list(data["plans"].values())
+    while pending:
+        plan = pending.pop()
+        labels.add(plan["model"])
+        pending += [p["plan"] for p in plan["prefetch"] if isinstance(p, dict)]
+    for label in sorted(labels):
+        try:
+            apps.get_model(label)
+        except (LookupError, ValueError):
+            problems.append("the model {} doesn't exist".format(label))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m graphene_django_optimizer")
+    subparsers = parser.add_subparsers(dest="command")
+    compile_parser = subparsers.add_parser(
+        "compile-plans",
+        help="compile the plans of the persisted documents of a manifest",
+    )
+    compile_parser.add_argument("schema", help="dotted path of the schema")
+    compile_parser.add_argument(
+        "manifest", help="json file that maps the persisted ids to their documents"
+    )
+    compile_parser.add_argument(
+        "-o", "--output", help="file where the plans are written, stdout by default"
+    )
+    check_parser = subparsers.add_parser(
+        "check-plans", help="check that compiled plans match the schema"
+    )
+    check_parser.add_argument("schema", help="dotted path of the schema")
+    check_parser.add_argument("plans", help="json file of the compiled plans")
+    args = parser.parse_args(argv)
+    if args.command not in ("compile-plans", "check-plans"):
+        parser.print_help()
+        return 2
+
+    django.setup()
+    schema = import_string(args.schema)
+    if args.command == "compile-plans":
+        return _compile_plans(schema, args.manifest, args.output)
+    return _check_plans(schema, args.plans)
+
+
+def get_schema_hash(schema):
+    graphql_schema = getattr(schema, "graphql_schema", schema)
+    return hashlib.sha256(print_schema(graphql_schema).encode()).hexdigest()
+
+
+def get_root_resolve_infos(schema, document, variables=None, context_value=None):
+    """
+    Return the resolve info of each root field of each operation of a
+    document, as it is received by its resolver.
+    """
+    graphql_schema = getattr(schema, "graphql_schema", schema)
+    document_ast = parse(document)
+    infos = []
+    for definition in document_ast.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        context = ExecutionContext.build(
+            graphql_schema,
+            document_ast,
+            context_value=context_value,
+            raw_variable_values=variables,
+            operation_name=definition.name.value if definition.name else None,
+        )
+        if isinstance(context, list):
+            raise ValueError(context[0].message)
+        parent_type = get_operation_root_type(graphql_schema, context.operation)
+        fields = collect_fields_compat(
+            context, parent_type, context.operation.selection_set
+        )
+        for response_key, field_nodes in fields.items():
+            field_def = get_field_def_compat(
+                graphql_schema, parent_type, field_nodes[0]
+            )
+            infos.append(
+                GraphQLResolveInfo(
+                    field_nodes[0].name.value,
+                    field_nodes,
+                    field_def.type,
+                    parent_type,
+                    Path(None, response_key, parent_type.name),
+                    graphql_schema,
+                    context.fragments,
+                    context.root_value,
+                    context.operation,
+                    context.variable_values,
+                    context.context_value,
+                    context.is_awaitable,
+                )
+            )
+    return infos
+
+
+def _get_document_hash(document):
+    return hashlib.sha256(document.encode()).hexdigest()
+
+
+def _get_plan_key(document_hash, operation, path):
+    operation_name = operation.name.value if operation.name else ""
+    field_path = ".".join(key for key in path.as_list() if isinstance(key, str))
+    return "{}:{}:{}".format(document_hash, operation_name, field_path)
+
+
+def _get_plan_data(queryset):
+    """
+    Return the lookups applied by the optimizer to a queryset of all the
+    rows of its model, or None if they can't be serialized.
+    """
+    query = queryset.query
+    if (
+        query.where
+        or not all(isinstance(field, str) for field in query.order_by)
+        or query.annotations
+        or query.distinct
+        or query.extra
+        or query.select_related is True
+    ):
+        return None
+    if issubclass(queryset._iterable_class, ReferenceModelIterable):
+        reference_list = list(queryset._iterable_class.reference_lookups)
+        stub_list = list(queryset._iterable_class.stub_lookups)
+    elif queryset._iterable_class is ModelIterable:
+        reference_list = []
+        stub_list = []
+    else:
+        return None
+    prefetch_list = []
+    for lookup in queryset._prefetch_related_lookups:
+        if not isinstance(lookup, Prefetch):
+            prefetch_list.append(lookup)
+            continue
+        if lookup.queryset is None:
+            return None
+        plan = _get_plan_data(lookup.queryset)
+        if plan is None:
+            return None
+        prefetch_list.append(
+            {"lookup": lookup.prefetch_through, "to_attr": lookup.to_attr, "plan": plan}
+        )
+    field_names, defer = query.deferred_loading
+    return {
+        "model": queryset.model._meta.label,
+        "select": _get_select_lookups(query.select_related or {}),
+        "prefetch": prefetch_list,
+        "only": None if defer else sorted(field_names),
+        "defer": sorted(field_names) if defer else None,
+        "reference": reference_list,
+        "stub": stub_list,
+        # None keeps the default ordering of the model.
+        "ordering": list(query.order_by)
+        if query.order_by or not query.default_ordering
+        else None,
+    }
+
+
+def _get_select_lookups(select_related, prefix=""):
+    lookups = []
+    for name, nested in select_related.items():
+        if nested:
+            lookups += _get_select_lookups(nested, prefix + name + "__")
+        else:
+            lookups.append(prefix + name)
+    return lookups
+
+
+def _apply_plan_data(queryset, plan):
+    if plan.get("ordering") is not None:
+        queryset = queryset.order_by(*plan["ordering"])
+    if plan["select"]:
+        queryset = queryset.select_related(*plan["select"])
+    if plan["prefetch"]:
+        queryset = queryset.prefetch_related(
+            *[_load_prefetch(prefetch) for prefetch in plan["prefetch"]]
+        )
+    if plan["only"] is not None:
+        queryset = queryset.only(*plan["only"])
+    elif plan["defer"]:
+        queryset = queryset.defer(*plan["defer"])
+    if (
+        plan["reference"] or plan["stub"]
+    ) and queryset._iterable_class is ModelIterable:
+        queryset = queryset.all()
+        queryset._iterable_class = get_reference_iterable_class(
+            tuple(plan["reference"]), tuple(plan["stub"])
+        )
+    return queryset
+
+
+def _load_prefetch(prefetch):
+    if not isinstance(prefetch, dict):
+        return prefetch
+    plan = prefetch["plan"]
+    queryset = apps.get_model(plan["model"]).objects.all()
+    return Prefetch(
+        prefetch["lookup"],
+        queryset=_apply_plan_data(queryset, plan),
+        to_attr=prefetch["to_attr"],
+    )
+
+
+def _compile_plans(schema, manifest_path, output_path):
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    data = compile_plans(schema, manifest.values())
+    output = json.dumps(data, indent=2, sort_keys=True)
+    if output_path:
+        with open(output_path, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    print(
+        "{} plan(s) compiled from {} document(s)".format(
+            len(data["plans"]), len(manifest)
+        ),
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _check_plans(schema, plans_path):
+    with open(plans_path) as plans_file:
+        problems = check_plans(json.load(plans_file), schema)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
@@ -0,0 +1,183 @@
+import logging
+import random
+import threading
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+
+from .utils import get_field_path, get_operation_name, replace_prefetch_querysets
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZE = "optimize"
+INSTANCES = "instances"
+PREFETCH = "prefetch"
+
+# Sections measured at the same time, like in the threads of a server,
+# share tracemalloc.
+_tracing_lock = threading.Lock()
+_sections = 0
+_owns_tracing = False
+
+MemoryReport = namedtuple(
+    "MemoryReport", ("operation", "path", "kind", "size", "peak", "top_stats")
+)
+
+
+def log_memory_report(report):
+    logger.info(
+        "%s %s %s: %d bytes allocated, %d bytes peak",
+        report.operation or "<anonymous>",
+        report.path,
+        report.kind,
+        report.size,
+        report.peak,
+    )
+
+
+class MemoryProfiler(object):
+    """
+    Measure the memory used by optimized operations with tracemalloc.
+
+    For each sampled call to `query`, a report is sent for the optimization
+    of the queryset, for the instantiation of its rows and for every
+    prefetch queryset. Tracing is only enabled while a sampled part runs.
+    The peak of sections measured at the same time includes the allocations
+    of all of them.
+
+    Arguments:
+        - reporter - callable that receives each MemoryReport. By default,
+                     reports are logged.
+        - sample_rate - fraction of the calls that are profiled.
+        - snapshot_limit - number of allocation sites included in each
+                           report. Snapshots are skipped when it is 0.
+        - frames - number of frames stored for each allocation.
+    """
+
+    def __init__(self, reporter=None, sample_rate=1.0, snapshot_limit=10, frames=1):
+        self.reporter = reporter or log_memory_report
+        self.sample_rate = sample_rate
+        self.snapshot_limit = snapshot_limit
+        self.frames = frames
+
+    def sample(self):
+        return random.random() < self.sample_rate
+
+    @contextmanager
+    def trace(self, info, kind, path=None):
+        alone = _start_tracing(self.frames)
+        if alone and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        try:
+            before_snapshot = self._take_snapshot()
+            before, _ = tracemalloc.get_traced_memory()
+            try:
+                yield
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                top_stats = []
+                if before_snapshot is not None:
+                    top_stats = self._take_snapshot().compare_to(
+                        before_snapshot, "lineno"
+                    )
+                    top_stats = top_stats[: self.snapshot_limit]
+                self.reporter(
+                    MemoryReport(
+                        get_operation_name(info),
+                        path or get_field_path(info),
+                        kind,
+                        current - before,
+                        max(peak - before, 0),
+                        top_stats,
+                    )
+                )
+        finally:
+            _stop_tracing()
+
+    def attach(self, queryset, info, path=None, kind=INSTANCES):
+        """
+        Return a copy of the queryset whose evaluation, and the evaluation of
+        each of its prefetch querysets, is profiled.
+        """
+        path = path or get_field_path(info)
+        if issubclass(queryset._iterable_class, ModelIterable):
+            bases = (MemoryProfiledModelIterable, queryset._iterable_class)
+            if issubclass(queryset._iterable_class, MemoryProfiledModelIterable):
+                # The prefetch querysets optimized by their own hint are
+                # profiled again with the path of the prefetch.
+                bases = (queryset._iterable_class,)
+            queryset = queryset.all()
+            queryset._iterable_class = type(
+                "MemoryProfiledModelIterable",
+                bases,
+                {"profiler": self, "info": info, "path": path, "kind": kind},
+            )
+        return replace_prefetch_querysets(
+            queryset,
+            lambda lookup: self.attach(
+                lookup.queryset,
+                info,
+                path + "." + lookup.prefetch_to.replace(LOOKUP_SEP, "."),
+                PREFETCH,
+            ),
+        )
+
+    def _take_snapshot(self):
+        if not self.snapshot_limit:
+            return None
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+
+
+class MemoryProfiledModelIterable(ModelIterable):
+    """
+    Iterable that reports the memory used to load its instances.
+
+    The instances read by `iterator()` aren't profiled, since the memory
+    allocated by the caller between two instances would be reported too.
+    """
+
+    profiler = None
+    info = None
+    path = None
+    kind = INSTANCES
+
+    def __iter__(self):
+        instances = super(MemoryProfiledModelIterable, self).__iter__()
+        if self.chunked_fetch:
+            yield from instances
+            return
+        with self.profiler.trace(self.info, self.kind, self.path):
+            yield from instances
+
+
+def _start_tracing(frames):
+    """
+    Start tracemalloc for a measured section, unless it is already tracing,
+    and return whether no other section is being measured.
+    """
+    global _sections, _owns_tracing
+    with _tracing_lock:
+        if _sections == 0:
+            _owns_tracing = not tracemalloc.is_tracing()
+            if _owns_tracing:
+                tracemalloc.start(frames)
+        _sections += 1
+        return _sections == 1
+
+
+def _stop_tracing():
+    """
+    Stop tracemalloc when the last measured section ends, if it was started
+    by the profiler.
+    """
+    global _sections, _owns_tracing
+    with _tracing_lock:
+        _sections -= 1
+        if _sections == 0 and _owns_tracing:
+            tracemalloc.stop()
+            _owns_tracing = False
@@ -1,9 +1,13 @@
+import copy
 import functools
+from collections import namedtuple
 
-from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import router
 from django.db.models import ForeignKey, Prefetch
 from django.db.models.constants import LOOKUP_SEP
 from django.db.models.fields.reverse_related import ManyToOneRel
+from django.db.models.query import ModelIterable
 from graphene import InputObjectType
 from graphene.types.generic import GenericScalar
 from graphene.types.resolver import default_resolver
@@ -12,6 +16,7 @@ from graphql import GraphQLResolveInfo, GraphQLSchema
 from graphql.language.ast import (
     FragmentSpreadNode,
     InlineFragmentNode,
+    OperationType,
     VariableNode,
 )
 from graphql.type.definition import (
@@ -19,9 +24,23 @@ from graphql.type.definition import (
     GraphQLUnionType,
 )
 
+from graphql.execution.values import get_argument_values
 from graphql.pyutils import Path
 
-from .utils import is_iterable, get_field_def_compat
+from .hints import OptimizedPrefetch, get_ordered_prefetch_to_attr
+from .inference import infer_optimization_hints
+from .lazy import defer_optimization
+from .profiling import OPTIMIZE
+from .reference import get_reference_iterable_class
+from .registry import get_heavy_fields, is_reference_model
+from .statistics import JOIN, PREFETCH
+from .utils import (
+    is_iterable,
+    get_field_def_compat,
+    get_through_relation,
+    map_querysets,
+    noop,
+)
 
 
 def query(queryset, info, **options):
@@ -34,9 +53,52 @@ def query(queryset, info, **options):
         - **options - optimization options/settings
             - disable_abort_only (boolean) - in case the objecttype contains any extra fields,
                                              then this will keep the "only" optimization enabled.
+            - database (string) - database alias used by the queryset and every generated
+                                  prefetch queryset. It can also be set in the
+                                  `gql_optimizer_database` attribute of the request context.
+                                  Mutations keep using the database for writes.
+            - statistics (PlannerStatistics) - row counts used to choose between joining
+                                               and prefetching foreign keys, and updated
+                                               with the rows loaded by the queryset. It can
+                                               also be set in the `gql_optimizer_statistics`
+                                               attribute of the request context.
+            - prefetch_coordinator (PrefetchCoordinator) - request-scoped cache that shares the
+                                                           rows of identical prefetches between
+                                                           root fields. It can also be set in the
+                                                           `gql_optimizer_prefetch_coordinator`
+                                                           attribute of the request context.
+            - identity_map (IdentityMap) - request-scoped map that keeps one instance per row
+                                           for the queryset and its prefetches. It can also be
+                                           set in the `gql_optimizer_identity_map` attribute of
+                                           the request context.
+            - memory_profiler (MemoryProfiler) - reports the memory used to optimize the queryset
+                                                 and to load its rows and prefetches. It can
+                                                 also be set in the `gql_optimizer_memory_profiler`
+                                                 attribute of the request context.
+            - lazy (boolean) - return the queryset without optimizing it, and optimize it
+                               only when it is evaluated, after the filters, ordering and
+                               slicing applied to it later. It can also be set in the
+                               `gql_optimizer_lazy` attribute of the request context.
+            - compiled_plans (CompiledPlans) - plans compiled from the persisted documents,
+                                               used instead of walking the selections of
+                                               known operations. It can also be set in the
+                                               `gql_optimizer_compiled_plans` attribute of
+                                               the request context.
+            - query_tracer (QueryTracer) - starts a span with the GraphQL path of the queryset
+                                           or prefetch whenever one of them runs SQL. It can
+                                           also be set in the `gql_optimizer_query_tracer`
+                                           attribute of the request context.
     """
 
-    return QueryOptimizer(info, **options).optimize(queryset)
+    optimizer = QueryOptimizer(info, **options)
+    if optimizer.lazy and issubclass(queryset._iterable_class, ModelIterable):
+        queryset = defer_optimization(queryset, optimizer.optimize)
+    else:
+        queryset = optimizer.optimize(queryset).all()
+    # Kept by the clones of the queryset, as the query is copied with its
+    # attributes.
+    queryset.query.gql_optimized = True
+    return queryset
 
 
 class QueryOptimizer(object):
@@ -46,19 +108,107 @@ class QueryOptimizer(object):
 
     def __init__(self, info, **options):
         self.root_info = info
+        self.graphql_schema = self._get_graphql_schema(info.schema)
         self.disable_abort_only = options.pop("disable_abort_only", False)
+        self.database = options.pop("database", None) or getattr(
+            info.context, "gql_optimizer_database", None
+        )
+        self.statistics = options.pop("statistics", None) or getattr(
+            info.context, "gql_optimizer_statistics", None
+        )
+        self.foreign_keys = set()
+        self.identity_map = options.pop("identity_map", None) or getattr(
+            info.context, "gql_optimizer_identity_map", None
+        )
+        self.prefetch_coordinator = options.pop(
+            "prefetch_coordinator", None
+        ) or getattr(info.context, "gql_optimizer_prefetch_coordinator", None)
+        self.memory_profiler = options.pop("memory_profiler", None) or getattr(
+            info.context, "gql_optimizer_memory_profiler", None
+        )
+        self.lazy = options.pop("lazy", False) or getattr(
+            info.context, "gql_optimizer_lazy", False
+        )
+        self.compiled_plans = options.pop("compiled_plans", None) or getattr(
+            info.context, "gql_optimizer_compiled_plans", None
+        )
+        self.query_tracer = options.pop("query_tracer", None) or getattr(
+            info.context, "gql_optimizer_query_tracer", None
+        )
+        # Whether the plan only depends on the document, so it can be compiled.
+        self.compilable = True
 
     def optimize(self, queryset):
+        profiler = self.memory_profiler
+        if profiler and profiler.sample():
+            with profiler.trace(self.root_info, OPTIMIZE):
+                queryset = self._optimize_queryset(queryset)
+            queryset = profiler.attach(queryset, self.root_info)
+        else:
+            queryset = self._optimize_queryset(queryset)
+        if self.query_tracer:
+            queryset = self.query_tracer.attach(queryset, self.root_info)
+        if self.prefetch_coordinator:
+            # Done last, as it removes the prefetches from the queryset.
+            queryset = self.prefetch_coordinator.coordinate(queryset)
+        return queryset
+
+    def get_store(self):
+        """
+        Return the store of the selections of the field being resolved.
+        """
         info = self.root_info
         field_def = get_field_def_compat(
             info.schema, info.parent_type, info.field_nodes[0]
         )
+        field_type = self._get_type(field_def)
         store = self._optimize_gql_selections(
-            self._get_type(field_def),
+            field_type,
             info.field_nodes[0],
             # info.parent_type,
         )
-        return store.optimize_queryset(queryset)
+        # The same response key can be selected several times, and GraphQL
+        # merges the selections of all its field nodes.
+        for field_node in info.field_nodes[1:]:
+            store.append(self._optimize_gql_selections(field_type, field_node))
+        return store
+
+    def _optimize_queryset(self, queryset):
+        plan = None
+        if self.compiled_plans and not (self.statistics or self.disable_abort_only):
+            plan = self.compiled_plans.get_plan(self.root_info, queryset.model)
+        if plan is not None:
+            queryset = plan.apply(queryset)
+        else:
+            queryset = self.get_store().optimize_queryset(queryset)
+        if self.database:
+            queryset = map_querysets(queryset, self._pin_database)
+        if self.statistics:
+            queryset = map_querysets(queryset, self._collect_statistics)
+        if self.identity_map:
+            queryset = map_querysets(queryset, self.identity_map.attach)
+        return queryset
+
+    def _get_database(self, model):
+        if self.root_info.operation.operation == OperationType.MUTATION:
+            # Mutation payloads must see the rows that were just written.
+            return router.db_for_write(model)
+        return self.database
+
+    def _pin_database(self, queryset):
+        if queryset._db is None:
+            queryset = queryset.using(self._get_database(queryset.model))
+        return queryset
+
+    def _collect_statistics(self, queryset):
+        return self.statistics.collect(queryset, self.foreign_keys)
+
+    def _get_relation_strategy(self, model_field):
+        if not self.statistics or not model_field.concrete:
+            return JOIN
+        self.compilable = False
+        self.foreign_keys.add(model_field)
+        return self.statistics.get_strategy(model_field)
 
     def _get_type(self, field_def):
         a_type = field_def.type
@@ -74,13 +224,16 @@ class QueryOptimizer(object):
 
     def _get_possible_types(self, graphql_type):
         if isinstance(graphql_type, (GraphQLInterfaceType, GraphQLUnionType)):
-            graphql_schema = self._get_graphql_schema(self.root_info.schema)
-            return graphql_schema.get_possible_types(graphql_type)
+            return self.graphql_schema.get_possible_types(graphql_type)
         else:
             return (graphql_type,)
 
     def _get_base_model(self, graphql_types):
-        models = tuple(t.graphene_type._meta.model for t in graphql_types)
+        models = tuple(
+            getattr(t.graphene_type._meta, "model", None) for t in graphql_types
+        )
+        if None in models:
+            return None
         for model in models:
             if all(issubclass(m, model) for m in models):
                 return model
@@ -102,24 +255,36 @@ class QueryOptimizer(object):
             )
             if not select_related_name:
                 continue
-            fragment_store = self._optimize_gql_selections(
-                fragment_possible_type,
-                selection,
-                # parent_type,
-            )
+            fragment_store = yield fragment_possible_type, selection
             store.select_related(select_related_name, fragment_store)
         return store
 
     def handle_fragment_spread(self, store, name, field_type):
         fragment = self.root_info.fragments[name]
-        fragment_store = self._optimize_gql_selections(
-            field_type,
-            fragment,
-            # parent_type,
-        )
+        fragment_store = yield field_type, fragment
         store.append(fragment_store)
 
     def _optimize_gql_selections(self, field_type, field_ast):
+        """
+        Walk the selections with an explicit stack instead of recursion.
+
+        Each level is a generator that yields the (field_type, field_ast) of
+        the nested selections it needs, and receives their store back.
+        """
+        stack = [self._walk_gql_selections(field_type, field_ast)]
+        result = None
+        while stack:
+            try:
+                nested_selection = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+            else:
+                stack.append(self._walk_gql_selections(*nested_selection))
+                result = None
+        return result
+
+    def _walk_gql_selections(self, field_type, field_ast):
         store = QueryOptimizerStore(
             disable_abort_only=self.disable_abort_only,
         )
@@ -127,20 +292,25 @@ class QueryOptimizer(object):
         selection_set = field_ast.selection_set
         if not selection_set:
             return store
-        optimized_fields_by_model = {}
         schema = self.root_info.schema
-        graphql_schema = self._get_graphql_schema(schema)
-        graphql_type = graphql_schema.get_type(field_type.name)
+        graphql_type = self.graphql_schema.get_type(field_type.name)
 
         possible_types = self._get_possible_types(graphql_type)
+        store.model = self._get_base_model(possible_types)
         for selection in selection_set.selections:
             if isinstance(selection, InlineFragmentNode):
-                self.handle_inline_fragment(selection, schema, possible_types, store)
+                yield from self.handle_inline_fragment(
+                    selection, schema, possible_types, store
+                )
             else:
                 name = selection.name.value
                 if isinstance(selection, FragmentSpreadNode):
-                    self.handle_fragment_spread(store, name, field_type)
+                    yield from self.handle_fragment_spread(store, name, field_type)
                 else:
+                    # Only the first possible type that has the field is used,
+                    # but a field selected twice is optimized twice, so both
+                    # sub-selections are merged.
+                    field_optimized = False
                     for possible_type in possible_types:
                         selection_field_def = possible_type.fields.get(name)
                         if not selection_field_def:
@@ -152,7 +322,7 @@ class QueryOptimizer(object):
                             hasattr(graphene_type, "cursor")
                             and hasattr(graphene_type, "node")
                         ):
-                            relay_store = self._optimize_gql_selections(
+                            relay_store = yield (
                                 self._get_type(selection_field_def),
                                 selection,
                             )
@@ -163,33 +333,56 @@ class QueryOptimizer(object):
                                 store.abort_only_optimization()
                         else:
                             model = getattr(graphene_type._meta, "model", None)
-                            if model and name not in optimized_fields_by_model:
-                                field_model = optimized_fields_by_model[name] = model
-                                if field_model == model:
-                                    self._optimize_field(
-                                        store,
-                                        model,
-                                        selection,
-                                        selection_field_def,
-                                        possible_type,
-                                    )
+                            if model and not field_optimized:
+                                field_optimized = True
+                                store.fields_selected = True
+                                yield from self._optimize_field(
+                                    store,
+                                    model,
+                                    selection,
+                                    selection_field_def,
+                                    possible_type,
+                                )
         return store
 
     def _optimize_field(self, store, model, selection, field_def, parent_type):
-        optimized_by_name = self._optimize_field_by_name(
-            store, model, selection, field_def
+        optimized_by_name = yield from self._optimize_field_by_name(
+            store, model, selection, field_def, parent_type
         )
-        optimized_by_hints = self._optimize_field_by_hints(
+        optimized_by_hints = yield from self._optimize_field_by_hints(
             store, selection, field_def, parent_type
         )
         optimized = optimized_by_name or optimized_by_hints
+        if not optimized:
+            optimized = yield from self._optimize_field_by_inference(
+                store, model, selection, field_def, parent_type
+            )
         if not optimized:
             store.abort_only_optimization()
 
-    def _optimize_field_by_name(self, store, model, selection, field_def):
+    def _optimize_field_by_name(self, store, model, selection, field_def, parent_type):
         name = self._get_name_from_resolver(field_def.resolve)
         if not name:
             return False
+        optimization_hints = self._get_optimization_hints(field_def.resolve)
+        ordered = bool(optimization_hints and optimization_hints.ordering is not None)
+        ordering = None
+        if ordered:
+            ordering = optimization_hints.ordering(
+                self._get_hint_info(selection, field_def, parent_type),
+                *self._get_hint_args(selection)
+            )
+            if isinstance(ordering, str):
+                ordering = (ordering,)
+        return (
+            yield from self._optimize_model_field(
+                store, model, name, selection, field_def, ordered, ordering
+            )
+        )
+
+    def _optimize_model_field(
+        self, store, model, name, selection, field_def, ordered=False, ordering=None
+    ):
         model_field = self._get_model_field_from_name(model, name)
         if not model_field:
             return False
@@ -197,36 +390,133 @@ class QueryOptimizer(object):
             store.only(name)
             return True
         if model_field.many_to_one or model_field.one_to_one:
-            field_store = self._optimize_gql_selections(
-                self._get_type(field_def),
-                selection,
-                # parent_type,
-            )
-            store.select_related(name, field_store)
+            field_store = yield self._get_type(field_def), selection
+            if (
+                model_field.concrete
+                and is_reference_model(model_field.related_model)
+                and self._is_columns_only(field_store)
+            ):
+                # The cached reference instances have all their columns
+                # loaded, but none of their relations.
+                store.only(model_field.attname)
+                store.reference(name)
+            elif self._is_primary_key_only(model_field, field_store):
+                # The primary key is the foreign key column of this row, so
+                # the related object doesn't need to be joined.
+                store.only(model_field.attname)
+                store.stub(name)
+            elif self._get_relation_strategy(model_field) == PREFETCH:
+                # Each related row would be repeated in many joined rows.
+                store.only(model_field.attname)
+                # The related objects are matched by key, so they aren't
+                # sorted.
+                related_queryset = model_field.related_model.objects.order_by()
+                store.prefetch_related(name, field_store, related_queryset)
+            else:
+                store.select_related(name, field_store)
+            return True
+        through_relation = self._get_through_relation(model_field, field_def)
+        if through_relation:
+            # The rows of the through model are prefetched instead, and the
+            # related objects are loaded with them.
+            through, source_name, accessor = through_relation
+            field_store = yield self._get_type(field_def), selection
+            field_store.only(source_name)
+            store.prefetch_related(accessor, field_store, through.objects.all())
             return True
         if model_field.one_to_many or model_field.many_to_many:
-            field_store = self._optimize_gql_selections(
-                self._get_type(field_def),
-                selection,
-                # parent_type,
-            )
+            related_queryset = model_field.related_model.objects.all()
+            if ordering is not None:
+                try:
+                    related_queryset = related_queryset.order_by(*ordering)
+                except (FieldError, TypeError):
+                    # The resolver orders the relation itself and reports
+                    # the error in the field.
+                    return False
+
+            field_store = yield self._get_type(field_def), selection
 
             if isinstance(model_field, ManyToOneRel):
                 field_store.only(model_field.field.name)
 
-            related_queryset = model_field.related_model.objects.all()
-            store.prefetch_related(name, field_store, related_queryset)
+            filtered_queryset, to_attr = self._filter_prefetch_queryset(
+                related_queryset, selection, field_def
+            )
+            if ordered and not to_attr:
+                # Each ordered field has its own prefetch, read by its
+                # resolver, so fields with other orderings don't share it.
+                to_attr = get_ordered_prefetch_to_attr(
+                    selection.alias.value if selection.alias else selection.name.value
+                )
+            store.prefetch_related(name, field_store, filtered_queryset, to_attr)
             return True
         if not model_field.is_relation:
             store.only(name)
             return True
         return False
 
+    def _get_through_relation(self, model_field, field_def):
+        through_relation = get_through_relation(model_field)
+        if not through_relation:
+            return None
+        graphene_type = getattr(self._get_type(field_def), "graphene_type", None)
+        meta = getattr(graphene_type, "_meta", None)
+        if getattr(meta, "model", None) is not through_relation[0]:
+            # The field resolves to the related objects.
+            return None
+        return through_relation
+
+    def _filter_prefetch_queryset(self, queryset, selection, field_def):
+        # Fields like OptimizedDjangoFilterConnectionField filter the prefetch
+        # queryset with their arguments, and read it from its own attribute.
+        field_class = getattr(
+            getattr(field_def.resolve, "func", None), "__self__", None
+        )
+        filter_prefetch_queryset = getattr(
+            field_class, "filter_prefetch_queryset", None
+        )
+        if not filter_prefetch_queryset:
+            return queryset, None
+        self.compilable = False
+        args = get_argument_values(field_def, selection, self.root_info.variable_values)
+        filtered_queryset = filter_prefetch_queryset(
+            field_def.resolve, queryset, args, self.root_info.context
+        )
+        if filtered_queryset is None:
+            return queryset, None
+        response_key = (
+            selection.alias.value if selection.alias else selection.name.value
+        )
+        return filtered_queryset, field_class.get_prefetch_to_attr(response_key)
+
+    def _optimize_field_by_inference(
+        self, store, model, selection, field_def, parent_type
+    ):
+        if self._get_optimization_hints(field_def.resolve):
+            # Hand-written hints override the inferred ones.
+            return False
+        name = self._get_name_from_resolver(field_def.resolve)
+        if not isinstance(name, str):
+            return False
+        optimization_hints = infer_optimization_hints(model, name)
+        if not optimization_hints:
+            return False
+        related_name = optimization_hints.model_field()
+        if related_name:
+            return (
+                yield from self._optimize_model_field(
+                    store, model, related_name, selection, field_def
+                )
+            )
+        self._add_hints_to_store(store, optimization_hints, None, ())
+        return True
+
     def _get_optimization_hints(self, resolver):
         return getattr(resolver, "optimization_hints", None)
 
     def _get_value(self, info, value):
         if isinstance(value, VariableNode):
+            self.compilable = False
             var_name = value.name.value
             value = info.variable_values.get(var_name)
             return value
@@ -239,40 +529,98 @@ class QueryOptimizer(object):
         optimization_hints = self._get_optimization_hints(field_def.resolve)
         if not optimization_hints:
             return False
-        info = self._create_resolve_info(
-            selection.name.value,
+        if optimization_hints.is_empty and not optimization_hints.infer:
+            return False
+        if not optimization_hints.is_static:
+            self.compilable = False
+        info = self._get_hint_info(selection, field_def, parent_type)
+        args = self._get_hint_args(selection)
+        prefetches = self._add_hints_to_store(store, optimization_hints, info, args)
+        for prefetch in prefetches:
+            yield from self._optimize_hinted_prefetch(
+                store, prefetch, selection, field_def
+            )
+        return True
+
+    def _get_hint_info(self, selection, field_def, parent_type):
+        # The resolve info is only created if a hint function reads it.
+        return _LazyResolveInfo(
+            functools.partial(
+                self._create_resolve_info,
+                selection.name.value,
+                (selection,),
+                self._get_type(field_def),
+                parent_type,
+            ),
             (selection,),
-            self._get_type(field_def),
-            parent_type,
+            self.root_info.fragments,
+            self.root_info.variable_values,
         )
 
-        args = []
-        for arg in selection.arguments:
-            args.append(self._get_value(info, arg.value))
-        args = tuple(args)
+    def _get_hint_args(self, selection):
+        return tuple(
+            self._get_value(self.root_info, arg.value) for arg in selection.arguments
+        )
+
+    def _optimize_hinted_prefetch(self, store, prefetch, selection, field_def):
+        model = store.model
+        model_field = None
+        for name in prefetch.prefetch_through.split(LOOKUP_SEP):
+            model_field = model and self._get_model_field_from_name(model, name)
+            model = model_field.related_model if model_field else None
+        if model is None:
+            # The relation can't be resolved, so it is prefetched as given.
+            store.prefetch_list.append(prefetch)
+            return
+        field_store = yield self._get_type(field_def), selection
+        if isinstance(model_field, ManyToOneRel):
+            field_store.only(model_field.field.name)
+        queryset = prefetch.queryset
+        if queryset is None:
+            queryset = model.objects.all()
+        store.prefetch_related(
+            prefetch.prefetch_through, field_store, queryset, prefetch.to_attr
+        )
 
+    def _add_hints_to_store(self, store, optimization_hints, info, args):
+        """
+        Add the hints to the store, and return the OptimizedPrefetch objects
+        of the prefetch_related hint, which need the sub-selection.
+        """
         self._add_optimization_hints(
-            optimization_hints.select_related(info, *args),
-            store.select_list,
+            optimization_hints.select_related, info, args, store.select_list
+        )
+        prefetches = self._get_hint_values(
+            optimization_hints.prefetch_related, info, args
         )
+        optimized_prefetches = []
+        other_prefetches = []
+        for prefetch in prefetches:
+            if isinstance(prefetch, OptimizedPrefetch):
+                optimized_prefetches.append(prefetch)
+            else:
+                other_prefetches.append(prefetch)
+        self._extend_hint_target(store.prefetch_list, other_prefetches)
         self._add_optimization_hints(
-            optimization_hints.prefetch_related(info, *args),
-            store.prefetch_list,
+            optimization_hints.only, info, args, store.only_list
         )
-        if store.only_list is not None:
-            self._add_optimization_hints(
-                optimization_hints.only(info, *args),
-                store.only_list,
-            )
-        return True
+        return optimized_prefetches
 
-    def _add_optimization_hints(self, source, target):
-        if source:
-            if not is_iterable(source):
-                source = (source,)
-            target += [
-                source_item for source_item in source if source_item not in target
-            ]
+    def _add_optimization_hints(self, hint, info, args, target):
+        self._extend_hint_target(target, self._get_hint_values(hint, info, args))
+
+    def _get_hint_values(self, hint, info, args):
+        if hint is noop:
+            return ()
+        source = hint(info, *args)
+        if not source:
+            return ()
+        if not is_iterable(source):
+            source = (source,)
+        return source
+
+    def _extend_hint_target(self, target, source):
+        target += [source_item for source_item in source if source_item not in target]
 
     def _get_name_from_resolver(self, resolver):
         optimization_hints = self._get_optimization_hints(resolver)
@@ -321,6 +669,23 @@ class QueryOptimizer(object):
                 descriptor, "related", None
             )  # Django < 1.9
 
+    def _is_columns_only(self, store):
+        return not (
+            store.only_aborted
+            or store.select_list
+            or store.prefetch_list
+            or store.reference_list
+            or store.stub_list
+        )
+
+    def _is_primary_key_only(self, model_field, store):
+        if not model_field.concrete or not model_field.target_field.primary_key:
+            return False
+        if not self._is_columns_only(store):
+            return False
+        pk = model_field.related_model._meta.pk
+        return set(store.only_list) <= {"pk", pk.name, pk.attname}
+
     def _is_foreign_key_id(self, model_field, name):
         return (
             isinstance(model_field, ForeignKey)
@@ -345,74 +710,369 @@ class QueryOptimizer(object):
         )
 
 
+class _LazyResolveInfo(object):
+    """
+    Proxy that creates the GraphQLResolveInfo passed to hint functions
+    the first time one of its attributes is read. The attributes of the
+    selection, which key the results of pure hints, don't create it.
+    """
+
+    __slots__ = ("_factory", "_info", "field_nodes", "fragments", "variable_values")
+
+    def __init__(self, factory, field_nodes, fragments, variable_values):
+        self._factory = factory
+        self._info = None
+        self.field_nodes = field_nodes
+        self.fragments = fragments
+        self.variable_values = variable_values
+
+    def __getattr__(self, name):
+        if self._info is None:
+            self._info = self._factory()
+        return getattr(self._info, name)
+
+
+QueryOptimizerPlan = namedtuple(
+    "QueryOptimizerPlan",
+    (
+        "select_list",
+        "prefetch_list",
+        "only_list",
+        "defer_list",
+        "reference_list",
+        "stub_list",
+    ),
+)
+
+
+class _PrefetchNode(object):
+    __slots__ = ("name", "store", "queryset", "to_attr")
+
+    def __init__(self, name, store, queryset, to_attr=None):
+        self.name = name
+        self.store = store
+        self.queryset = queryset
+        self.to_attr = to_attr
+
+
 class QueryOptimizerStore:
-    def __init__(self, disable_abort_only=False):
+    """
+    Optimization plan of the selections of a field.
+
+    Each store keeps the columns, hints and references of its own model,
+    and the stores of its relations. The tree is converted to Django lookups
+    only once, by flatten, which doesn't modify it.
+    """
+
+    __slots__ = (
+        "select_list",
+        "prefetch_list",
+        "only_list",
+        "reference_list",
+        "stub_list",
+        "select_stores",
+        "prefetch_nodes",
+        "only_aborted",
+        "model",
+        "disable_abort_only",
+        "fields_selected",
+    )
+
+    def __init__(self, disable_abort_only=False, model=None):
         self.select_list = []
         self.prefetch_list = []
         self.only_list = []
+        self.reference_list = []
+        self.stub_list = []
+        self.select_stores = {}
+        self.prefetch_nodes = {}
+        self.only_aborted = False
+        self.model = model
         self.disable_abort_only = disable_abort_only
+        # Whether a field of the model is selected, and not only fields like
+        # totalCount, pageInfo or __typename.
+        self.fields_selected = False
 
     def select_related(self, name, store):
-        if store.select_list:
-            for select in store.select_list:
-                self.select_list.append(name + LOOKUP_SEP + select)
+        if name in self.select_stores:
+            self.select_stores[name].append(store)
         else:
+            self.select_stores[name] = store
             self.select_list.append(name)
-        for prefetch in store.prefetch_list:
-            if isinstance(prefetch, Prefetch):
-                prefetch.add_prefix(name)
-            else:
-                prefetch = name + LOOKUP_SEP + prefetch
-            self.prefetch_list.append(prefetch)
-        if self.only_list is not None:
-            if store.only_list is None:
-                self.abort_only_optimization()
-            else:
-                for only in store.only_list:
-                    self.only_list.append(name + LOOKUP_SEP + only)
-
-    def prefetch_related(self, name, store, queryset):
-        if store.select_list or store.only_list:
-            queryset = store.optimize_queryset(queryset)
-            self.prefetch_list.append(Prefetch(name, queryset=queryset))
-        elif store.prefetch_list:
-            for prefetch in store.prefetch_list:
-                if isinstance(prefetch, Prefetch):
-                    prefetch.add_prefix(name)
-                else:
-                    prefetch = name + LOOKUP_SEP + prefetch
-                self.prefetch_list.append(prefetch)
+
+    def prefetch_related(self, name, store, queryset, to_attr=None):
+        key = to_attr or name
+        if key in self.prefetch_nodes:
+            self.prefetch_nodes[key].store.append(store)
         else:
-            self.prefetch_list.append(name)
+            node = _PrefetchNode(name, store, queryset, to_attr)
+            self.prefetch_nodes[key] = node
+            self.prefetch_list.append(node)
 
     def only(self, field):
-        if self.only_list is not None:
-            self.only_list.append(field)
+        self.only_list.append(field)
+
+    def reference(self, name):
+        self.reference_list.append(name)
+
+    def stub(self, name):
+        self.stub_list.append(name)
 
     def abort_only_optimization(self):
         if not self.disable_abort_only:
-            self.only_list = None
+            self.only_aborted = True
+
+    def append(self, store):
+        for name in store.select_list:
+            if name in store.select_stores:
+                self.select_related(name, store.select_stores[name])
+            else:
+                self.select_list.append(name)
+        for prefetch in store.prefetch_list:
+            if isinstance(prefetch, _PrefetchNode):
+                self.prefetch_related(
+                    prefetch.name, prefetch.store, prefetch.queryset, prefetch.to_attr
+                )
+            elif prefetch not in self.prefetch_list:
+                # Django doesn't accept two Prefetch objects with the same
+                # to_attr, which happens when a hinted field is selected twice.
+                self.prefetch_list.append(prefetch)
+        self.only_list += store.only_list
+        self.reference_list += store.reference_list
+        self.stub_list += store.stub_list
+        if self.model is None:
+            self.model = store.model
+        if store.only_aborted:
+            self.abort_only_optimization()
+        self.fields_selected = self.fields_selected or store.fields_selected
 
     def optimize_queryset(self, queryset):
-        if self.select_list:
-            queryset = queryset.select_related(*self.select_list)
+        return _apply_plan(queryset, self.flatten(queryset.model))
 
-        if self.prefetch_list:
-            queryset = queryset.prefetch_related(*self.prefetch_list)
+    def flatten(self, model):
+        """
+        Convert the tree of stores to the lookups of a queryset of `model`.
 
-        if self.only_list:
-            queryset = queryset.only(*self.only_list)
+        The defer list is None when "only" can be used, which is the case
+        unless the root store is aborted.
+        """
+        nodes = self._get_select_nodes(model)
+        select_list = []
+        prefetch_list = []
+        only_list = []
+        reference_list = []
+        stub_list = []
+        only_aborted = any(node_model is None for _, node_model, _ in nodes)
 
-        return queryset
+        for path, node_model, store in nodes:
+            prefix = path + LOOKUP_SEP if path else ""
+            for name in store.select_list:
+                if name not in store.select_stores:
+                    select_list.append(prefix + name)
+                elif not store.select_stores[name].select_list:
+                    select_list.append(prefix + name)
+            for prefetch in store.prefetch_list:
+                prefetch_list += _prefix_prefetch(path, prefetch)
+            for reference in store.reference_list:
+                reference_list.append(prefix + reference)
+            for stub in store.stub_list:
+                stub_list.append(prefix + stub)
+            if not path:
+                only_aborted = only_aborted or store.only_aborted
+            for only in store.get_only_list(node_model):
+                only_list.append(prefix + only)
 
-    def append(self, store):
-        self.select_list += store.select_list
-        self.prefetch_list += store.prefetch_list
-        if self.only_list is not None:
-            if store.only_list is None:
-                self.only_list = None
-            else:
-                self.only_list += store.only_list
+        if only_aborted:
+            defer_list = self._get_defer_list(nodes, select_list, prefetch_list)
+        else:
+            defer_list = None
+            if not self.fields_selected:
+                # The rows are only counted or identified.
+                only_list.append(model._meta.pk.name)
+        return QueryOptimizerPlan(
+            select_list, prefetch_list, only_list, defer_list, reference_list, stub_list
+        )
+
+    def get_only_list(self, model):
+        """
+        Return the "only" list of the own model of this store.
+
+        An aborted store loads every column of its model that is not
+        registered as heavy, so the rest of the models can keep using "only".
+        """
+        if not self.only_aborted or model is None:
+            return self.only_list
+        heavy_fields = get_heavy_fields(model)
+        only_list = list(self.only_list)
+        for field in model._meta.local_concrete_fields:
+            if field.name not in heavy_fields and field.name not in only_list:
+                only_list.append(field.name)
+        return only_list
+
+    def _get_select_nodes(self, model):
+        # Return (path, model, store) for every store joined with
+        # select_related, parents first. The model is None when the path
+        # can't be resolved.
+        nodes = []
+        pending = [("", model, self)]
+        while pending:
+            path, model, store = pending.pop()
+            nodes.append((path, model, store))
+            for name in reversed(store.select_list):
+                select_store = store.select_stores.get(name)
+                if select_store is None:
+                    continue
+                related_model = model
+                for part in name.split(LOOKUP_SEP):
+                    if related_model is None:
+                        break
+                    try:
+                        field = related_model._meta.get_field(part)
+                    except FieldDoesNotExist:
+                        related_model = None
+                    else:
+                        related_model = field.related_model
+                store_path = path + LOOKUP_SEP + name if path else name
+                pending.append((store_path, related_model, select_store))
+        return nodes
+
+    def _get_defer_list(self, nodes, select_list, prefetch_list):
+        """
+        Return the columns that can be deferred when "only" can't be used.
+
+        Django tracks deferred columns per model, so a column is deferred only
+        if it is not needed by any part of the query that loads that model.
+        Aborted stores need every column except the heavy ones.
+        """
+        model = nodes[0][1]._meta.concrete_model
+        needed = {}
+        lookups = {}
+        stores = {path: (node_model, store) for path, node_model, store in nodes}
+        if any(node_model is None for node_model, _ in stores.values()):
+            return []
+
+        def walk(from_model, lookup):
+            # Mark the columns used to traverse a lookup as needed and return
+            # the final model, or None if the lookup is not a relation path.
+            for part in lookup.split(LOOKUP_SEP):
+                try:
+                    field = from_model._meta.get_field(part)
+                except FieldDoesNotExist:
+                    return None
+                if field.concrete:
+                    key = field.model._meta.concrete_model
+                    needed.setdefault(key, set()).add(field.attname)
+                from_model = field.related_model
+                if from_model is None:
+                    return None
+            return from_model
+
+        for select in select_list:
+            related_model = model
+            path = ""
+            for part in select.split(LOOKUP_SEP):
+                path = path + LOOKUP_SEP + part if path else part
+                related_model = walk(related_model, part)
+                if related_model is None:
+                    return []
+                if path not in stores:
+                    # Selected by a hint, so any column could be used.
+                    stores[path] = (related_model, None)
+        for prefetch in prefetch_list:
+            if isinstance(prefetch, Prefetch):
+                prefetch = prefetch.prefetch_through
+            walk(model, prefetch.split(LOOKUP_SEP)[0])
+
+        for path, (store_model, store) in stores.items():
+            prefix = path + LOOKUP_SEP if path else ""
+            heavy_fields = get_heavy_fields(store_model)
+            only_set = set(store.only_list) if store else set()
+            for field in store_model._meta.concrete_fields:
+                key = field.model._meta.concrete_model
+                lookups.setdefault(key, {}).setdefault(
+                    field.attname, prefix + field.name
+                )
+                if (
+                    field.primary_key
+                    or field.name in only_set
+                    or field.attname in only_set
+                    or (
+                        (store is None or store.only_aborted)
+                        and field.name not in heavy_fields
+                    )
+                ):
+                    needed.setdefault(key, set()).add(field.attname)
+            for only in only_set:
+                if LOOKUP_SEP in only:
+                    walk(store_model, only)
+
+        defer_list = []
+        for key, key_lookups in lookups.items():
+            key_needed = needed.get(key, set())
+            for attname, lookup in key_lookups.items():
+                if attname not in key_needed:
+                    defer_list.append(lookup)
+        return defer_list
+
+
+def _apply_plan(queryset, plan):
+    if plan.select_list:
+        queryset = queryset.select_related(*plan.select_list)
+
+    if plan.prefetch_list:
+        queryset = queryset.prefetch_related(*plan.prefetch_list)
+
+    if plan.defer_list is not None:
+        if plan.defer_list:
+            queryset = queryset.defer(*plan.defer_list)
+    elif plan.only_list:
+        queryset = queryset.only(*plan.only_list)
+
+    if (
+        plan.reference_list or plan.stub_list
+    ) and queryset._iterable_class is ModelIterable:
+        queryset = queryset.all()
+        queryset._iterable_class = get_reference_iterable_class(
+            tuple(plan.reference_list), tuple(plan.stub_list)
+        )
+
+    return queryset
+
+
+def _prefix_prefetch(path, prefetch):
+    """
+    Return the lookups of a prefetch entry of the store found at `path`.
+    Prefetch objects given by hints are copied instead of being modified.
+    """
+    if isinstance(prefetch, _PrefetchNode):
+        lookup = path + LOOKUP_SEP + prefetch.name if path else prefetch.name
+        plan = prefetch.store.flatten(prefetch.queryset.model)
+        if prefetch.to_attr:
+            return [
+                Prefetch(
+                    lookup,
+                    queryset=_apply_plan(prefetch.queryset, plan),
+                    to_attr=prefetch.to_attr,
+                )
+            ]
+        if (
+            plan.select_list
+            or plan.reference_list
+            or plan.stub_list
+            or (plan.defer_list if plan.defer_list is not None else plan.only_list)
+        ):
+            return [Prefetch(lookup, queryset=_apply_plan(prefetch.queryset, plan))]
+        return [
+            prefixed_prefetch
+            for plan_prefetch in plan.prefetch_list
+            for prefixed_prefetch in _prefix_prefetch(lookup, plan_prefetch)
+        ] or [lookup]
+    if isinstance(prefetch, Prefetch):
+        prefetch = copy.copy(prefetch)
+        if path:
+            prefetch.add_prefix(path)
+        return [prefetch]
+    return [path + LOOKUP_SEP + prefetch if path else prefetch]
 
 
 # For legacy Django versions:
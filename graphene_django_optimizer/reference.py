@@ -0,0 +1,111 @@
+import functools
+import threading
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_reference_instance(model, field_name, value, using=DEFAULT_DB_ALIAS):
+    """
+    Return the instance of a reference model whose `field_name` is `value`.
+
+    The whole table of the `using` database is loaded the first time it is
+    needed and kept in memory until one of its rows is saved or deleted.
+    """
+    key = (model, using, field_name)
+    instances = _cache.get(key)
+    if instances is None:
+        with _cache_lock:
+            instances = _cache.get(key)
+            if instances is None:
+                instances = {
+                    getattr(instance, field_name): instance
+                    for instance in model._default_manager.using(using)
+                }
+                _cache[key] = instances
+    return instances.get(value)
+
+
+def invalidate_reference_cache(sender, using=None, **kwargs):
+    """
+    Clear the cached instances of `sender` loaded from the `using` database,
+    or from every database if it isn't given.
+    """
+    with _cache_lock:
+        for key in list(_cache):
+            if key[0] is sender and using in (None, key[1]):
+                del _cache[key]
+
+
+class ReferenceModelIterable(ModelIterable):
+    """
+    Iterable that attaches cached reference instances, and stubs of the
+    related objects of which only the primary key is used, to the loaded
+    objects instead of joining their tables.
+    """
+
+    reference_lookups = ()
+    stub_lookups = ()
+
+    def __iter__(self):
+        for obj in super(ReferenceModelIterable, self).__iter__():
+            for lookup in self.reference_lookups:
+                _attach_reference_instance(obj, lookup.split(LOOKUP_SEP))
+            for lookup in self.stub_lookups:
+                _attach_stub_instance(obj, lookup.split(LOOKUP_SEP))
+            yield obj
+
+
+@functools.lru_cache(maxsize=None)
+def get_reference_iterable_class(reference_lookups, stub_lookups=()):
+    return type(
+        "ReferenceModelIterable",
+        (ReferenceModelIterable,),
+        {"reference_lookups": reference_lookups, "stub_lookups": stub_lookups},
+    )
+
+
+def _get_related_object(obj, path):
+    for name in path:
+        field = obj._meta.get_field(name)
+        if not field.is_cached(obj):
+            return None
+        obj = field.get_cached_value(obj)
+        if obj is None:
+            return None
+    return obj
+
+
+def _attach_reference_instance(obj, path):
+    obj = _get_related_object(obj, path[:-1])
+    if obj is None:
+        return
+    field = obj._meta.get_field(path[-1])
+    value = getattr(obj, field.attname)
+    if value is None:
+        return
+    instance = get_reference_instance(
+        field.related_model, field.target_field.attname, value, obj._state.db
+    )
+    if instance is not None:
+        field.set_cached_value(obj, instance)
+
+
+def _attach_stub_instance(obj, path):
+    obj = _get_related_object(obj, path[:-1])
+    if obj is None:
+        return
+    field = obj._meta.get_field(path[-1])
+    value = getattr(obj, field.attname)
+    if value is None or field.is_cached(obj):
+        return
+    # The rest of the columns are deferred, so they are loaded if they are
+    # ever read.
+    instance = field.related_model.from_db(
+        obj._state.db, [field.target_field.attname], [value]
+    )
+    field.set_cached_value(obj, instance)
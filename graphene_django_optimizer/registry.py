@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save
+
+from .reference import invalidate_reference_cache
+
+_heavy_fields = {}
+_reference_models = set()
+# Incremented on each registration, so that the values computed from the
+# registry, like the inferred optimization hints, are computed again.
+_version = 0
+
+
+def register_heavy_fields(model, *field_names):
+    """
+    Mark model columns that should stay deferred unless they are selected.
+
+    When the "only" optimization has to be aborted for a model, every column
+    of that model is loaded except the ones registered here.
+    """
+    global _version
+    _heavy_fields.setdefault(model, set()).update(field_names)
+    _version += 1
+
+
+def get_heavy_fields(model):
+    heavy_fields = set(_heavy_fields.get(model, ()))
+    for parent in model._meta.get_parent_list():
+        heavy_fields.update(_heavy_fields.get(parent, ()))
+    return heavy_fields
+
+
+def register_reference_model(model):
+    """
+    Mark a small, rarely changing model as cached reference data.
+
+    Foreign keys to a reference model are not joined. Only the foreign key
+    column is loaded and the related instance is taken from an in-process
+    cache, which is cleared when a row of the model is saved or deleted.
+    """
+    global _version
+    _reference_models.add(model)
+    _version += 1
+    dispatch_uid = "graphene_django_optimizer_reference_{}".format(model._meta.label)
+    post_save.connect(
+        invalidate_reference_cache, sender=model, dispatch_uid=dispatch_uid
+    )
+    post_delete.connect(
+        invalidate_reference_cache, sender=model, dispatch_uid=dispatch_uid
+    )
+
+
+def get_registry_version():
+    return _version
+
+
+def is_reference_model(model):
+    return model in _reference_models
@@ -1,10 +1,12 @@
-from .hints import OptimizationHints
+from .hints import OptimizationHints, resolve_ordered_prefetch
 
 
 def resolver_hints(*args, **kwargs):
     optimization_hints = OptimizationHints(*args, **kwargs)
 
     def apply_resolver_hints(resolver):
+        if optimization_hints.ordering is not None:
+            resolver = resolve_ordered_prefetch(resolver)
         resolver.optimization_hints = optimization_hints
         return resolver
 
@@ -0,0 +1,134 @@
+import threading
+
+from django.db.models.query import ModelIterable
+
+JOIN = "join"
+PREFETCH = "prefetch"
+
+
+class PlannerStatistics(object):
+    """
+    Row counts observed for the foreign keys optimized by the planner.
+
+    For every foreign key, the number of loaded rows that reference an
+    object and the number of distinct objects they reference are added up.
+    When each related object is repeated many times, joining it copies its
+    columns in all those rows, so a separate prefetch query is cheaper.
+
+    Arguments:
+        - prefetch_fan_out - average number of rows per related object from
+                             which the relation is prefetched instead of joined.
+        - min_rows - number of rows that must be observed before the
+                     statistics are used.
+    """
+
+    def __init__(self, prefetch_fan_out=10, min_rows=100):
+        self.prefetch_fan_out = prefetch_fan_out
+        self.min_rows = min_rows
+        self._counts = {}
+        self._overrides = {}
+        self._lock = threading.Lock()
+
+    def record(self, field, rows, related_rows):
+        with self._lock:
+            counts = self._counts.get(field, (0, 0))
+            self._counts[field] = (counts[0] + rows, counts[1] + related_rows)
+
+    def get_counts(self, field):
+        """
+        Return the (rows, related rows) observed for a foreign key.
+        """
+        return self._counts.get(field, (0, 0))
+
+    def get_fan_out(self, field):
+        rows, related_rows = self.get_counts(field)
+        if not related_rows:
+            return None
+        return rows / related_rows
+
+    def override(self, model, name, strategy):
+        """
+        Force the strategy of a relation, regardless of the statistics.
+        """
+        if strategy not in (JOIN, PREFETCH, None):
+            raise ValueError("Unknown strategy {!r}".format(strategy))
+        field = model._meta.get_field(name)
+        if strategy is None:
+            self._overrides.pop(field, None)
+        else:
+            self._overrides[field] = strategy
+
+    def get_strategy(self, field):
+        if field in self._overrides:
+            return self._overrides[field]
+        rows, _ = self.get_counts(field)
+        fan_out = self.get_fan_out(field)
+        if (
+            rows >= self.min_rows
+            and fan_out is not None
+            and fan_out >= self.prefetch_fan_out
+        ):
+            return PREFETCH
+        return JOIN
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+    def collect(self, queryset, fields):
+        """
+        Return a copy of the queryset that counts the rows of `fields`
+        loaded by it or by its select_related joins.
+        """
+        if not fields or not issubclass(queryset._iterable_class, ModelIterable):
+            return queryset
+        queryset = queryset.all()
+        queryset._iterable_class = type(
+            "StatisticsModelIterable",
+            (StatisticsModelIterable, queryset._iterable_class),
+            {"statistics": self, "fields": tuple(fields)},
+        )
+        return queryset
+
+
+class StatisticsModelIterable(ModelIterable):
+    """
+    Iterable that records the row counts of foreign keys once the queryset
+    has been loaded.
+    """
+
+    statistics = None
+    fields = ()
+
+    def __iter__(self):
+        select_related = self.queryset.query.select_related
+        if not isinstance(select_related, dict):
+            select_related = {}
+        values = {}
+        for obj in super(StatisticsModelIterable, self).__iter__():
+            _count_values(obj, self.fields, select_related, values)
+            yield obj
+        for field, (rows, related_values) in values.items():
+            self.statistics.record(field, rows, len(related_values))
+
+
+def _count_values(obj, fields, select_related, values):
+    pending = [(obj, select_related)]
+    while pending:
+        obj, select_related = pending.pop()
+        for field in fields:
+            if not isinstance(obj, field.model):
+                continue
+            # Deferred columns are not loaded to be counted.
+            value = obj.__dict__.get(field.attname)
+            if value is None:
+                continue
+            counts = values.setdefault(field, [0, set()])
+            counts[0] += 1
+            counts[1].add(value)
+        for name, nested in select_related.items():
+            field = obj._meta.get_field(name)
+            if field.is_cached(obj):
+                related_obj = field.get_cached_value(obj)
+                if related_obj is not None:
+                    pending.append((related_obj, nested))
@@ -0,0 +1,157 @@
+"""
+Helpers to test the optimization of a schema, for pytest or unittest.
+"""
+from collections import namedtuple
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Prefetch
+from django.db.models.constants import LOOKUP_SEP
+from django.test.utils import CaptureQueriesContext
+
+from .persisted import get_root_resolve_infos
+from .query import QueryOptimizer
+
+ExecutionQueries = namedtuple("ExecutionQueries", ("result", "queries"))
+
+
+def execute_query(
+    schema,
+    document,
+    variables=None,
+    context_value=None,
+    using=DEFAULT_DB_ALIAS,
+    **kwargs
+):
+    """
+    Execute a document and return its result with the SQL of the queries
+    executed in the `using` database. Keyword arguments, like `middleware`,
+    are passed to `schema.execute`.
+    """
+    with CaptureQueriesContext(connections[using]) as context:
+        result = schema.execute(
+            document, variables=variables, context_value=context_value, **kwargs
+        )
+    return ExecutionQueries(
+        result, [query["sql"] for query in context.captured_queries]
+    )
+
+
+def create_resolve_info(schema, document, variables=None, context_value=None):
+    """
+    Return the resolve info of the first root field of a document, as it
+    is received by its resolver.
+    """
+    return get_root_resolve_infos(schema, document, variables, context_value)[0]
+
+
+def _format_queries(queries):
+    return "\n".join("{}. {}".format(i + 1, sql) for i, sql in enumerate(queries))
+
+
+def assert_max_queries(schema, document, max_queries, **kwargs):
+    """
+    Execute a document and fail if it has errors or runs more than
+    `max_queries` queries. Keyword arguments are passed to execute_query.
+    """
+    execution = execute_query(schema, document, **kwargs)
+    assert not execution.result.errors, execution.result.errors
+    assert (
+        len(execution.queries) <= max_queries
+    ), "Expected at most {} queries, {} were executed:\n{}".format(
+        max_queries, len(execution.queries), _format_queries(execution.queries)
+    )
+    return execution
+
+
+def assert_constant_queries(
+    schema, document, create_data, sizes=(1, 10), using=DEFAULT_DB_ALIAS, **kwargs
+):
+    """
+    Execute a document after creating each amount of rows in `sizes` with
+    `create_data(size)`, and fail if the number of queries changes with the
+    amount of rows. The rows of each size are rolled back.
+    """
+    counts = {}
+    executions = {}
+    for size in sizes:
+        with transaction.atomic(using=using):
+            create_data(size)
+            execution = execute_query(schema, document, using=using, **kwargs)
+            transaction.set_rollback(True, using=using)
+        assert not execution.result.errors, execution.result.errors
+        counts[size] = len(execution.queries)
+        executions[size] = execution
+    assert (
+        len(set(counts.values())) == 1
+    ), "The number of queries grows with the number of rows: {}\n{}".format(
+        ", ".join(
+            "{} rows: {} queries".format(size, count) for size, count in counts.items()
+        ),
+        _format_queries(executions[max(counts, key=counts.get)].queries),
+    )
+    return counts
+
+
+def assert_plan_equals(queryset, expected):
+    """
+    Fail if two querysets don't have the same SQL and prefetches.
+    """
+    assert str(queryset.query) == str(expected.query), "{}\n!=\n{}".format(
+        queryset.query, expected.query
+    )
+    lookups = queryset._prefetch_related_lookups
+    expected_lookups = expected._prefetch_related_lookups
+    assert [_get_lookup_path(lookup) for lookup in lookups] == [
+        _get_lookup_path(lookup) for lookup in expected_lookups
+    ]
+    for lookup, expected_lookup in zip(lookups, expected_lookups):
+        lookup_queryset = getattr(lookup, "queryset", None)
+        expected_queryset = getattr(expected_lookup, "queryset", None)
+        if lookup_queryset is None or expected_queryset is None:
+            assert (
+                lookup_queryset is expected_queryset is None
+            ), "Prefetch {} has a queryset in only one of the plans".format(
+                _get_lookup_path(lookup)
+            )
+        else:
+            assert_plan_equals(lookup_queryset, expected_queryset)
+
+
+def _get_lookup_path(lookup):
+    if isinstance(lookup, Prefetch):
+        return lookup.prefetch_to
+    return lookup
+
+
+def get_only_aborted_paths(info, **options):
+    """
+    Return the paths of the selections, relative to the root field of
+    `info`, whose "only" optimization is aborted.
+    """
+    store = QueryOptimizer(info, **options).get_store()
+    paths = []
+    pending = [("", store)]
+    while pending:
+        path, store = pending.pop()
+        if store.only_aborted:
+            paths.append(path)
+        children = list(store.select_stores.items())
+        children += [
+            (node.to_attr or node.name, node.store)
+            for node in store.prefetch_nodes.values()
+        ]
+        for name, child in reversed(children):
+            pending.append((path + LOOKUP_SEP + name if path else name, child))
+    return paths
+
+
+def assert_no_only_abort(schema, document, variables=None, **options):
+    """
+    Fail if the "only" optimization of any selection of the first root
+    field of a document is aborted.
+    """
+    info = create_resolve_info(schema, document, variables)
+    paths = get_only_aborted_paths(info, **options)
+    assert not paths, "The only() optimization is aborted for: {}".format(
+        ", ".join(path or "<root>" for path in paths)
+    )
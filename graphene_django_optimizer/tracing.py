@@ -0,0 +1,124 @@
+import time
+
+from django.db import connections
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+
+from .utils import get_field_path, get_operation_name, replace_prefetch_querysets
+
+
+class QueryTracer(object):
+    """
+    Trace the SQL run by optimized querysets, with the GraphQL path that
+    generated each of them.
+
+    For each call to `query`, the queryset and every prefetch
+    queryset are tagged with their path. A span is started whenever one of
+    them is evaluated, even long after the resolver returned it, with these
+    attributes:
+        - graphql.operation.name - name of the operation.
+        - graphql.path - path of the field, followed by the prefetch lookup.
+        - db.system - vendor of the database.
+        - db.statement - SQL statements executed.
+        - db.duration_ms - time spent executing them, in milliseconds.
+        - db.response.returned_rows - number of instances loaded.
+
+    Arguments:
+        - tracer - object whose `start_as_current_span(name, attributes=...)`
+                   returns a context manager of a span with a
+                   `set_attribute(key, value)` method, like an OpenTelemetry
+                   tracer. OpenTelemetry isn't required.
+    """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def attach(self, queryset, info, path=None):
+        """
+        Return a copy of the queryset whose evaluation, and the evaluation of
+        each of its prefetch querysets, is traced.
+        """
+        path = path or get_field_path(info)
+        if issubclass(queryset._iterable_class, ModelIterable):
+            bases = (TracedModelIterable, queryset._iterable_class)
+            if issubclass(queryset._iterable_class, TracedModelIterable):
+                # The prefetch querysets optimized by their own hint are
+                # traced again with the path of the prefetch.
+                bases = (queryset._iterable_class,)
+            queryset = queryset.all()
+            queryset._iterable_class = type(
+                "TracedModelIterable",
+                bases,
+                {"query_tracer": self, "info": info, "path": path},
+            )
+        return replace_prefetch_querysets(
+            queryset,
+            lambda lookup: self.attach(
+                lookup.queryset,
+                info,
+                path + "." + lookup.prefetch_to.replace(LOOKUP_SEP, "."),
+            ),
+        )
+
+    def trace(self, queryset, info, path, load):
+        """
+        Yield the instances loaded by `load`, in a span of the SQL it runs.
+
+        Only the statements run while loading the instances are recorded,
+        not the ones run by the caller between two instances, as with
+        `iterator()`.
+        """
+        connection = connections[queryset.db]
+        attributes = {
+            "graphql.path": path,
+            "db.system": connection.vendor,
+        }
+        operation_name = get_operation_name(info)
+        if operation_name:
+            attributes["graphql.operation.name"] = operation_name
+        statements = _StatementRecorder()
+        returned_rows = 0
+        with self.tracer.start_as_current_span(
+            "SELECT " + queryset.model._meta.db_table, attributes=attributes
+        ) as span:
+            try:
+                instances = load()
+                while True:
+                    with connection.execute_wrapper(statements):
+                        instance = next(instances, None)
+                    if instance is None:
+                        break
+                    returned_rows += 1
+                    yield instance
+            finally:
+                span.set_attribute("db.statement", ";\n".join(statements.sql))
+                span.set_attribute("db.duration_ms", statements.duration * 1000)
+                span.set_attribute("db.response.returned_rows", returned_rows)
+
+
+class _StatementRecorder(object):
+    def __init__(self):
+        self.sql = []
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.sql.append(sql)
+
+
+class TracedModelIterable(ModelIterable):
+    """
+    Iterable that loads its instances in a span of the tracer.
+    """
+
+    query_tracer = None
+    info = None
+    path = None
+
+    def __iter__(self):
+        load = super(TracedModelIterable, self).__iter__
+        return self.query_tracer.trace(self.queryset, self.info, self.path, load)
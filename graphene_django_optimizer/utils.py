@@ -1,4 +1,9 @@
+import copy
+from collections import defaultdict
+
 import graphql
+from django.db.models import Prefetch
+from django.db.models.fields.reverse_related import ManyToManyRel
 from graphql import GraphQLSchema, GraphQLObjectType, FieldNode
 from graphql.execution.execute import get_field_def
 
@@ -9,6 +14,10 @@ def is_iterable(obj):
     return hasattr(obj, "__iter__") and not isinstance(obj, str)
 
 
+def is_optimized(queryset):
+    return getattr(queryset.query, "gql_optimized", False)
+
+
 def get_field_def_compat(
     schema: GraphQLSchema, parent_type: GraphQLObjectType, field_node: FieldNode
 ):
@@ -17,3 +26,86 @@ def get_field_def_compat(
         parent_type,
         field_node.name.value if graphql.version_info < (3, 2) else field_node,
     )
+
+
+def get_through_relation(model_field):
+    """
+    Return the custom through model of a many to many relation, the name of
+    its foreign key to the model of the relation and the accessor of its rows
+    from that model, or None if the through model is created by Django.
+    """
+    if not model_field.many_to_many:
+        return None
+    if isinstance(model_field, ManyToManyRel):
+        m2m_field = model_field.field
+        source_name = m2m_field.m2m_reverse_field_name()
+    else:
+        m2m_field = model_field
+        source_name = m2m_field.m2m_field_name()
+    through = m2m_field.remote_field.through
+    if through._meta.auto_created:
+        return None
+    accessor = through._meta.get_field(source_name).remote_field.get_accessor_name()
+    return through, source_name, accessor
+
+
+def replace_prefetch_querysets(queryset, function):
+    """
+    Return a copy of the queryset whose Prefetch objects with a queryset are
+    copies with the queryset returned by `function(prefetch)`. The Prefetch
+    objects can be shared with other querysets, so they aren't modified.
+    """
+    if not any(
+        isinstance(lookup, Prefetch) and lookup.queryset is not None
+        for lookup in queryset._prefetch_related_lookups
+    ):
+        return queryset
+    lookups = []
+    for lookup in queryset._prefetch_related_lookups:
+        if isinstance(lookup, Prefetch) and lookup.queryset is not None:
+            queryset_copy = function(lookup)
+            lookup = copy.copy(lookup)
+            lookup.queryset = queryset_copy
+        lookups.append(lookup)
+    queryset = queryset._chain()
+    queryset._prefetch_related_lookups = tuple(lookups)
+    return queryset
+
+
+def map_querysets(queryset, function):
+    """
+    Apply a function to a queryset and to the querysets of its prefetches.
+    """
+    return replace_prefetch_querysets(
+        function(queryset),
+        lambda lookup: map_querysets(lookup.queryset, function),
+    )
+
+
+def get_operation_name(info):
+    name = info.operation.name
+    return name.value if name else None
+
+
+def get_field_path(info):
+    return ".".join(str(key) for key in info.path.as_list())
+
+
+def collect_fields_compat(exe_context, runtime_type, selection_set):
+    """
+    Return the field nodes of a selection set by response key, for the
+    versions of graphql-core before and after 3.2.
+    """
+    if graphql.version_info < (3, 2):
+        return exe_context.collect_fields(
+            runtime_type, selection_set, defaultdict(list), set()
+        )
+    from graphql.execution.collect_fields import collect_fields
+
+    return collect_fields(
+        exe_context.schema,
+        exe_context.fragments,
+        exe_context.variable_values,
+        runtime_type,
+        selection_set,
+    )
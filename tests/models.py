@@ -19,6 +19,10 @@ class Item(models.Model):
     def unoptimized_title(self):
         return self.title
 
+    @property
+    def parent_name(self):
+        return self.parent.name if self.parent_id else None
+
     def all_children(self):
         return self.children.all()
 
@@ -30,12 +34,32 @@ class DetailedItem(Item):
 
 class RelatedItem(Item):
     related_items = models.ManyToManyField(Item)
+    ranked_items = models.ManyToManyField(
+        Item,
+        through="RankedItem",
+        through_fields=("related_item", "item"),
+        related_name="ranked_by",
+    )
+
+
+class RankedItem(models.Model):
+    related_item = models.ForeignKey(
+        RelatedItem, on_delete=models.CASCADE, related_name="rankings"
+    )
+    item = models.ForeignKey(
+        Item, on_delete=models.CASCADE, related_name="item_rankings"
+    )
+    rank = models.IntegerField(default=0)
+    note = models.TextField(blank=True)
 
 
 class RelatedOneToManyItem(models.Model):
     name = models.CharField(max_length=100, blank=True)
     item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name="otm_items")
 
+    class Meta:
+        ordering = ("name",)
+
 
 class ExtraDetailedItem(DetailedItem):
     extra_detail = models.TextField()
@@ -4,11 +4,13 @@ from graphene import ConnectionField, relay
 from graphene_django.fields import DjangoConnectionField
 import graphene_django_optimizer as gql_optimizer
 from graphene_django_optimizer import OptimizedDjangoObjectType
+from graphene_django_optimizer.filter import OptimizedDjangoFilterConnectionField
 
 from .models import (
     DetailedItem,
     ExtraDetailedItem,
     Item,
+    RankedItem,
     RelatedItem,
     UnrelatedModel,
     SomeOtherItem,
@@ -43,6 +45,7 @@ class ItemInterface(graphene.Interface):
     foo = graphene.String()
     title = graphene.String()
     unoptimized_title = graphene.String()
+    parent_name = graphene.String()
     item_type = graphene.String()
     father = graphene.Field("tests.schema.ItemType")
     all_children = graphene.List("tests.schema.ItemType")
@@ -56,6 +59,10 @@ class ItemInterface(graphene.Interface):
         "tests.schema.ItemType",
         name=graphene.String(required=True),
     )
+    children_with_min_value = graphene.List(
+        "tests.schema.ItemType",
+        gte=graphene.Int(required=True),
+    )
     children_custom_filtered = gql_optimizer.field(
         ConnectionField("tests.schema.ItemConnection", filter_input=ItemFilterInput()),
         prefetch_related=_prefetch_children,
@@ -100,6 +107,17 @@ class ItemInterface(graphene.Interface):
     def resolve_aux_filtered_children(root, info, name):
         return getattr(root, "gql_filtered_children_" + name)
 
+    @gql_optimizer.resolver_hints(
+        prefetch_related=lambda info, gte: gql_optimizer.OptimizedPrefetch(
+            "children",
+            queryset=Item.objects.filter(value__gte=gte),
+            to_attr="gql_children_with_min_value_{}".format(gte),
+        ),
+        pure=True,
+    )
+    def resolve_children_with_min_value(root, info, gte):
+        return getattr(root, "gql_children_with_min_value_{}".format(gte))
+
     def resolve_children_custom_filtered(root, info, *_args):
         return getattr(root, "gql_custom_filtered_children")
 
@@ -109,22 +127,58 @@ class BaseItemType(OptimizedDjangoObjectType):
         graphene.String(),
         only="name",
     )
+    unoptimized_title = gql_optimizer.field(
+        graphene.String(),
+        infer=False,
+    )
     father = gql_optimizer.field(
         graphene.Field("tests.schema.ItemType"),
         model_field="parent",
     )
     relay_all_children = DjangoConnectionField("tests.schema.ItemNode")
+    filtered_relay_children = gql_optimizer.field(
+        OptimizedDjangoFilterConnectionField(
+            "tests.schema.ItemNode",
+            fields={"name": ["exact"], "value": ["gte"]},
+        ),
+        model_field="children",
+    )
+    ranked_by_rows = gql_optimizer.through_field(
+        "tests.schema.RankedItemType", "ranked_by"
+    )
+    unordered_otm_items = gql_optimizer.field(
+        graphene.List("tests.schema.RelatedOneToManyItemType"),
+        model_field="otm_items",
+        ordering=(),
+    )
+    sorted_otm_items = gql_optimizer.field(
+        graphene.List(
+            "tests.schema.RelatedOneToManyItemType", order_by=graphene.String()
+        ),
+        model_field="otm_items",
+        ordering=lambda info, order_by=None: order_by,
+    )
 
     class Meta:
         model = Item
         fields = "__all__"
 
+    def resolve_unordered_otm_items(root, info):
+        return root.otm_items.all()
+
+    def resolve_sorted_otm_items(root, info, order_by=None):
+        otm_items = root.otm_items.all()
+        return otm_items.order_by(order_by) if order_by else otm_items
+
     @gql_optimizer.resolver_hints(
         model_field="children",
     )
     def resolve_relay_all_children(root, info, **kwargs):
         return root.children.all()
 
+    def resolve_filtered_relay_children(root, info, **kwargs):
+        return root.children.all()
+
 
 class ItemNode(BaseItemType):
     class Meta:
@@ -138,10 +192,15 @@ class ItemNode(BaseItemType):
 
 
 class SomeOtherItemType(OptimizedDjangoObjectType):
+    foo = graphene.String()
+
     class Meta:
         model = SomeOtherItem
         fields = "__all__"
 
+    def resolve_foo(root, info):
+        return "bar"
+
 
 class OtherItemType(OptimizedDjangoObjectType):
     class Meta:
@@ -173,6 +232,10 @@ class DetailedItemType(ItemType):
 
 
 class RelatedItemType(ItemType):
+    ranked_item_rows = gql_optimizer.through_field(
+        "tests.schema.RankedItemType", "ranked_items"
+    )
+
     class Meta:
         model = RelatedItem
         fields = "__all__"
@@ -192,6 +255,12 @@ class RelatedOneToManyItemType(OptimizedDjangoObjectType):
         fields = "__all__"
 
 
+class RankedItemType(OptimizedDjangoObjectType):
+    class Meta:
+        model = RankedItem
+        fields = "__all__"
+
+
 class UnrelatedModelType(OptimizedDjangoObjectType):
     class Meta:
         model = UnrelatedModel
@@ -216,7 +285,9 @@ class DummyItemMutation(graphene.Mutation):
 class Query(graphene.ObjectType):
     items = graphene.List(ItemInterface, name=graphene.String(required=True))
     relay_items = DjangoConnectionField(ItemNode)
+    keyset_items = gql_optimizer.KeysetConnectionField(ItemNode, ordering=("-value",))
     other_items = graphene.List(OtherItemType)
+    related_items = graphene.List(RelatedItemType)
     some_other_items = graphene.List(SomeOtherItemType)
 
     def resolve_items(root, info, name):
@@ -225,8 +296,14 @@ class Query(graphene.ObjectType):
     def resolve_relay_items(root, info, **kwargs):
         return gql_optimizer.query(Item.objects.all(), info)
 
+    def resolve_keyset_items(root, info, **kwargs):
+        return gql_optimizer.query(Item.objects.all(), info)
+
+    def resolve_related_items(root, info):
+        return gql_optimizer.query(RelatedItem.objects.all(), info)
+
     def resolve_other_items(root, info):
-        return gql_optimizer.query(OtherItemType.objects.all(), info)
+        return gql_optimizer.query(OtherItem.objects.all(), info)
 
 
 class Schema(graphene.Schema):
@@ -3,5 +3,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
     },
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+    },
 }
 SECRET_KEY = "dummy"
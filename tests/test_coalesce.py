@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import graphene_django_optimizer as gql_optimizer
+
+from .models import Item
+from .schema import schema
+
+ALIASED_QUERY = """
+    fragment children on ItemNodeConnection {
+        edges {
+            node {
+                id
+                children {
+                    name
+                }
+            }
+        }
+    }
+
+    query {
+        first: relayItems(first: 1) {
+            ...children
+        }
+        second: relayItems(first: 1) {
+            ...children
+        }
+        third: relayItems(first: 2) {
+            ...children
+        }
+    }
+"""
+
+
+@pytest.fixture
+def items():
+    parents = [Item.objects.create(name=name) for name in ("foo", "bar")]
+    for parent in parents:
+        parent.children.create(name="{} child".format(parent.name))
+
+
+@pytest.mark.django_db
+def test_should_prefetch_relations_of_each_root_field_without_coordinator(
+    items, django_assert_num_queries
+):
+    with django_assert_num_queries(9):
+        result = schema.execute(ALIASED_QUERY, context_value=SimpleNamespace())
+    assert not result.errors
+
+
+@pytest.mark.django_db
+def test_should_share_identical_prefetches_between_root_fields(
+    items, django_assert_num_queries
+):
+    context = SimpleNamespace(
+        gql_optimizer_prefetch_coordinator=gql_optimizer.PrefetchCoordinator()
+    )
+    # The second field reuses the children of the first one, and the third
+    # one only prefetches the children of its second item.
+    with django_assert_num_queries(8):
+        result = schema.execute(ALIASED_QUERY, context_value=context)
+    assert not result.errors
+    for key in ("first", "second", "third"):
+        edges = result.data[key]["edges"]
+        assert [edge["node"]["children"] for edge in edges] == [
+            [{"name": "foo child"}],
+            [{"name": "bar child"}],
+        ][: len(edges)]
+
+
+class NoopSpan(object):
+    def set_attribute(self, key, value):
+        pass
+
+
+class NoopTracer(object):
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        yield NoopSpan()
+
+
+@pytest.mark.django_db
+def test_should_share_prefetches_of_querysets_wrapped_by_other_options(
+    items, django_assert_num_queries
+):
+    context = SimpleNamespace(
+        gql_optimizer_prefetch_coordinator=gql_optimizer.PrefetchCoordinator(),
+        gql_optimizer_identity_map=gql_optimizer.IdentityMap(),
+        gql_optimizer_query_tracer=gql_optimizer.QueryTracer(NoopTracer()),
+    )
+    with django_assert_num_queries(8):
+        result = schema.execute(ALIASED_QUERY, context_value=context)
+    assert not result.errors
+    edges = result.data["third"]["edges"]
+    assert [edge["node"]["children"] for edge in edges] == [
+        [{"name": "foo child"}],
+        [{"name": "bar child"}],
+    ]
@@ -18,6 +18,7 @@ def test_should_optimize_non_django_field_if_it_has_an_optimization_hint_in_the_
                 foo
                 father {
                     id
+                    name
                 }
             }
         }
@@ -0,0 +1,183 @@
+from types import SimpleNamespace
+
+import pytest
+from django.db.models import Prefetch
+from django.db.models.query import ModelIterable
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.testing import create_resolve_info
+
+from .models import Item
+from .schema import schema
+
+
+@pytest.fixture
+def parent():
+    parent = Item.objects.create(name="foo")
+    Item.objects.create(name="foo", parent=parent)
+    return parent
+
+
+@pytest.mark.django_db
+def test_should_keep_one_instance_per_row_in_optimized_querysets(parent):
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                father {
+                    id
+                    name
+                }
+            }
+        }
+    """,
+    )
+    identity_map = gql_optimizer.IdentityMap()
+    qs = Item.objects.filter(name="foo").order_by("id")
+    items = list(gql_optimizer.query(qs, info, identity_map=identity_map))
+    assert items[1].parent is items[0]
+    assert identity_map.get(Item, parent.pk) is items[0]
+
+
+@pytest.mark.django_db
+def test_should_resolve_foreign_keys_from_the_identity_map(
+    parent, django_assert_num_queries
+):
+    identity_map = gql_optimizer.IdentityMap()
+    parents = list(identity_map.attach(Item.objects.filter(parent=None)))
+    children = list(
+        identity_map.attach(Item.objects.exclude(parent=None).only("id", "parent"))
+    )
+    with django_assert_num_queries(0):
+        assert children[0].parent is parents[0]
+
+
+@pytest.mark.django_db
+def test_should_merge_the_columns_of_every_load(parent, django_assert_num_queries):
+    identity_map = gql_optimizer.IdentityMap()
+    (first,) = identity_map.attach(Item.objects.filter(pk=parent.pk).only("id"))
+    (second,) = identity_map.attach(
+        Item.objects.filter(pk=parent.pk).only("id", "name")
+    )
+    assert first is second
+    with django_assert_num_queries(0):
+        assert first.name == "foo"
+
+
+@pytest.mark.django_db
+def test_should_keep_the_prefetches_of_rows_loaded_twice(parent):
+    grandchild_parent = parent.children.get()
+    Item.objects.create(name="bar", parent=grandchild_parent)
+    document = """
+        query {
+            relayItems {
+                edges {
+                    node {
+                        id
+                        name
+                        children {
+                            id
+                            name
+                            children {
+                                id
+                                name
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    """
+    context = SimpleNamespace(gql_optimizer_identity_map=gql_optimizer.IdentityMap())
+    result = schema.execute(document, context_value=context)
+    assert not result.errors
+    nodes = [edge["node"] for edge in result.data["relayItems"]["edges"]]
+    assert [node["name"] for node in nodes] == ["foo", "foo", "bar"]
+    assert nodes[0]["children"][0]["name"] == "foo"
+    assert nodes[0]["children"][0]["children"][0]["name"] == "bar"
+    assert nodes[1]["children"][0]["name"] == "bar"
+    assert nodes[1]["children"][0]["children"] == []
+    assert nodes[2]["children"] == []
+
+
+@pytest.mark.django_db
+def test_should_not_attach_the_map_to_querysets_that_already_use_it(parent):
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                auxFilteredChildren(name: "bar") {
+                    id
+                }
+            }
+        }
+    """,
+        context_value=SimpleNamespace(
+            gql_optimizer_identity_map=gql_optimizer.IdentityMap()
+        ),
+    )
+    items = list(gql_optimizer.query(Item.objects.filter(name="foo"), info))
+    assert [item.gql_filtered_children_bar for item in items] == [[], []]
+
+
+@pytest.mark.django_db
+def test_should_not_modify_the_prefetches_of_the_queryset(parent):
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+            }
+        }
+    """,
+    )
+    prefetch = Prefetch("children", queryset=Item.objects.all())
+    qs = Item.objects.filter(name="foo").prefetch_related(prefetch)
+    identity_map = gql_optimizer.IdentityMap()
+    items = list(gql_optimizer.query(qs, info, identity_map=identity_map))
+    assert items[0].children.all()[0] is identity_map.get(Item, items[1].pk)
+    assert prefetch.queryset._iterable_class is ModelIterable
+
+
+@pytest.mark.django_db
+def test_should_prefetch_again_relations_that_load_other_columns(
+    parent, django_assert_num_queries
+):
+    Item.objects.create(name="bar", parent=parent)
+    document = """
+        query {
+            a: relayItems {
+                edges {
+                    node {
+                        id
+                        children {
+                            id
+                        }
+                    }
+                }
+            }
+            b: relayItems {
+                edges {
+                    node {
+                        id
+                        children {
+                            id
+                            name
+                        }
+                    }
+                }
+            }
+        }
+    """
+    with django_assert_num_queries(6):
+        expected = schema.execute(document)
+    context = SimpleNamespace(gql_optimizer_identity_map=gql_optimizer.IdentityMap())
+    with django_assert_num_queries(6):
+        result = schema.execute(document, context_value=context)
+    assert not result.errors
+    assert result.data == expected.data
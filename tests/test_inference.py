@@ -0,0 +1,39 @@
+from mock import patch
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.inference import infer_optimization_hints
+
+from .models import Item
+
+
+def test_should_follow_properties_used_by_a_property():
+    optimization_hints = infer_optimization_hints(Item, "unoptimized_title")
+    assert optimization_hints.only() == ("name",)
+    assert optimization_hints.select_related() == ()
+    assert optimization_hints.prefetch_related() == ()
+
+
+def test_should_alias_methods_returning_a_related_manager():
+    optimization_hints = infer_optimization_hints(Item, "all_children")
+    assert optimization_hints.model_field() == "children"
+
+
+def test_should_not_infer_attributes_that_are_not_properties_or_methods():
+    assert infer_optimization_hints(Item, "item_type") is None
+    assert infer_optimization_hints(Item, "missing") is None
+
+
+def get_parent(self):
+    return self.parent if self.parent_id else None
+
+
+@patch.dict("graphene_django_optimizer.registry._heavy_fields", {})
+def test_should_infer_hints_again_when_heavy_fields_are_registered(monkeypatch):
+    monkeypatch.setattr(Item, "parent_value", property(get_parent), raising=False)
+    optimization_hints = infer_optimization_hints(Item, "parent_value")
+    assert "parent__name" in optimization_hints.only()
+
+    gql_optimizer.register_heavy_fields(Item, "name")
+    optimization_hints = infer_optimization_hints(Item, "parent_value")
+    assert optimization_hints.select_related() == ("parent",)
+    assert "parent__name" not in optimization_hints.only()
@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import pytest
+from django.db import connection
+from django.db.models import Prefetch
+from django.test.utils import CaptureQueriesContext
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.query import QueryOptimizer
+from graphene_django_optimizer.testing import (
+    assert_max_queries,
+    assert_plan_equals,
+    create_resolve_info,
+)
+
+from .models import Item
+from .schema import schema
+
+CHILDREN_QUERY = """
+    query {
+        items(name: "foo") {
+            id
+            children {
+                id
+                name
+            }
+        }
+    }
+"""
+
+
+@pytest.fixture
+def items():
+    for name in ("foo", "bar"):
+        parent = Item.objects.create(name=name)
+        parent.children.create(name=name + "_child")
+
+
+@pytest.mark.django_db
+def test_should_optimize_lazily_after_later_chaining(items):
+    info = create_resolve_info(schema, CHILDREN_QUERY)
+    qs = gql_optimizer.query(Item.objects.all(), info, lazy=True)
+    assert_plan_equals(qs, Item.objects.all())
+    qs = qs.filter(parent=None).order_by("-name")
+    assert_plan_equals(
+        gql_optimizer.query(Item.objects.filter(parent=None).order_by("-name"), info),
+        Item.objects.filter(parent=None)
+        .order_by("-name")
+        .only("id")
+        .prefetch_related(
+            Prefetch("children", queryset=Item.objects.only("id", "name", "parent_id"))
+        ),
+    )
+    with CaptureQueriesContext(connection) as context:
+        items = list(qs[:1])
+        assert [child.name for child in items[0].children.all()] == ["foo_child"]
+    assert len(context.captured_queries) == 2
+    assert "name" in items[0].get_deferred_fields()
+
+
+@pytest.mark.django_db
+def test_should_not_optimize_unevaluated_querysets(items, monkeypatch):
+    calls = []
+    optimize = QueryOptimizer.optimize
+    monkeypatch.setattr(
+        QueryOptimizer, "optimize", lambda s, q: calls.append(q) or optimize(s, q)
+    )
+    info = create_resolve_info(schema, CHILDREN_QUERY)
+    qs = gql_optimizer.query(Item.objects.all(), info, lazy=True)
+    assert qs.count() == 4
+    assert not qs.filter(name="baz").exists()
+    assert calls == []
+    list(qs)
+    assert len(calls) == 1
+
+
+@pytest.mark.django_db
+def test_should_optimize_lazily_from_context(items):
+    context = SimpleNamespace(gql_optimizer_lazy=True)
+    execution = assert_max_queries(
+        schema,
+        """
+        query {
+            relayItems(first: 1) {
+                edges {
+                    node {
+                        children {
+                            name
+                        }
+                    }
+                }
+            }
+        }
+        """,
+        3,
+        context_value=context,
+    )
+    edges = execution.result.data["relayItems"]["edges"]
+    assert edges[0]["node"]["children"] == [{"name": "foo_child"}]
@@ -0,0 +1,59 @@
+from graphene_django_optimizer import cli
+from graphene_django_optimizer.lint import (
+    ABORT_ONLY,
+    NO_BASE_MODEL,
+    UNHINTED_RELATIONS,
+    lint_schema,
+    main,
+)
+
+from .schema import schema
+
+
+def get_codes(warnings, type_name, field_name=None):
+    return {
+        warning.code
+        for warning in warnings
+        if warning.type_name == type_name and warning.field_name == field_name
+    }
+
+
+def test_should_report_fields_that_abort_only_optimization():
+    warnings = lint_schema(schema)
+    assert get_codes(warnings, "SomeOtherItemType", "foo") == {ABORT_ONLY}
+    assert get_codes(warnings, "ItemType", "unoptimizedTitle") == {ABORT_ONLY}
+    # Model fields, hinted fields and inferred properties are optimized.
+    assert get_codes(warnings, "ItemType", "name") == set()
+    assert get_codes(warnings, "ItemType", "title") == set()
+    assert get_codes(warnings, "ItemType", "childrenNames") == set()
+    assert get_codes(warnings, "ItemType", "parentName") == set()
+
+
+def test_should_report_abstract_types_without_base_model():
+    warnings = lint_schema(schema)
+    assert get_codes(warnings, "DetailedInterface") == {NO_BASE_MODEL}
+    assert get_codes(warnings, "ItemInterface") == set()
+
+
+def test_should_report_resolvers_that_use_relations_without_hints(monkeypatch):
+    def resolve_foo(root, info):
+        return ", ".join(item.name for item in root.children.all())
+
+    field_def = schema.graphql_schema.get_type("ItemType").fields["foo"]
+    monkeypatch.setattr(field_def, "resolve", resolve_foo)
+    warnings = lint_schema(schema)
+    assert get_codes(warnings, "ItemType", "foo") == {ABORT_ONLY, UNHINTED_RELATIONS}
+
+
+def test_should_exit_with_error_when_there_are_warnings(capsys):
+    assert main(["lint", "tests.schema.schema"]) == 1
+    output = capsys.readouterr()
+    assert "SomeOtherItemType.foo: " in output.out
+    assert "warning(s)" in output.err
+
+
+def test_should_run_the_commands_of_the_command_line(capsys):
+    assert cli.main(["lint", "tests.schema.schema"]) == 1
+    assert "SomeOtherItemType.foo: " in capsys.readouterr().out
+    assert cli.main(["unknown"]) == 2
+    assert "compile-plans" in capsys.readouterr().err
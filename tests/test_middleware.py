@@ -0,0 +1,83 @@
+import graphene
+import pytest
+from graphene_django import DjangoConnectionField, DjangoListField
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.query import QueryOptimizer
+from graphene_django_optimizer.testing import assert_constant_queries, execute_query
+
+from .models import Item
+from .schema import ItemNode, ItemType
+
+
+class Query(graphene.ObjectType):
+    items = graphene.List(ItemType)
+    list_items = DjangoListField(ItemType)
+    relay_items = DjangoConnectionField(ItemNode)
+    optimized_items = graphene.List(ItemType)
+    names = graphene.List(graphene.String)
+
+    def resolve_items(root, info):
+        return Item.objects.filter(parent=None)
+
+    def resolve_list_items(root, info):
+        return Item.objects.filter(parent=None)
+
+    def resolve_relay_items(root, info, **kwargs):
+        return Item.objects.filter(parent=None)
+
+    def resolve_optimized_items(root, info):
+        return gql_optimizer.query(Item.objects.filter(parent=None), info)
+
+    def resolve_names(root, info):
+        return Item.objects.values_list("name", flat=True)
+
+
+schema = graphene.Schema(query=Query)
+
+middleware = [gql_optimizer.OptimizerMiddleware()]
+
+
+def create_items(size):
+    for i in range(size):
+        parent = Item.objects.create(name="parent{}".format(i))
+        parent.children.create(name="child{}".format(i))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "document",
+    [
+        "{ items { name children { name } } }",
+        "{ listItems { name children { name } } }",
+        "{ relayItems { edges { node { name children { name } } } } }",
+    ],
+)
+def test_should_optimize_querysets_of_unwrapped_resolvers(document):
+    assert_constant_queries(schema, document, create_items, middleware=middleware)
+    create_items(2)
+    execution = execute_query(schema, document)
+    assert not execution.result.errors
+    # Without the middleware, the children are queried for every item.
+    assert len(execution.queries) > len(
+        execute_query(schema, document, middleware=middleware).queries
+    )
+
+
+@pytest.mark.django_db
+def test_should_not_optimize_again_optimized_querysets(monkeypatch):
+    create_items(2)
+    calls = []
+    optimize = QueryOptimizer.optimize
+    monkeypatch.setattr(
+        QueryOptimizer, "optimize", lambda s, q: calls.append(q) or optimize(s, q)
+    )
+    execution = execute_query(
+        schema,
+        "{ optimizedItems { name children { name } } names }",
+        middleware=middleware,
+    )
+    assert not execution.result.errors
+    assert execution.result.data["names"] == ["parent0", "child0", "parent1", "child1"]
+    assert len(calls) == 1
+    assert len(execution.queries) == 3
@@ -0,0 +1,129 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from graphene_django_optimizer.pagination import get_keyset_keys
+from graphene_django_optimizer.testing import assert_max_queries
+
+from .models import Item
+from .schema import schema
+
+KEYSET_QUERY = """
+    query($first: Int, $last: Int, $after: String, $before: String) {
+        keysetItems(first: $first, last: $last, after: $after, before: $before) {
+            pageInfo {
+                hasNextPage
+                hasPreviousPage
+                startCursor
+                endCursor
+            }
+            edges {
+                node {
+                    name
+                }
+            }
+        }
+    }
+"""
+
+
+def execute_keyset_query(**variables):
+    result = schema.execute(KEYSET_QUERY, variables=variables)
+    assert not result.errors
+    connection = result.data["keysetItems"]
+    names = [edge["node"]["name"] for edge in connection["edges"]]
+    return names, connection["pageInfo"]
+
+
+@pytest.fixture
+def items():
+    for i, value in enumerate((30, 20, 20, 10, 0)):
+        Item.objects.create(id=i + 1, name="item {}".format(i + 1), value=value)
+
+
+@pytest.mark.django_db
+def test_should_page_forward_by_ordering_keys(items):
+    names, page_info = execute_keyset_query(first=2)
+    assert names == ["item 1", "item 2"]
+    assert page_info["hasNextPage"] is True
+    assert page_info["hasPreviousPage"] is False
+
+    names, page_info = execute_keyset_query(first=2, after=page_info["endCursor"])
+    assert names == ["item 3", "item 4"]
+    assert page_info["hasNextPage"] is True
+    assert page_info["hasPreviousPage"] is True
+
+    names, page_info = execute_keyset_query(first=2, after=page_info["endCursor"])
+    assert names == ["item 5"]
+    assert page_info["hasNextPage"] is False
+
+
+@pytest.mark.django_db
+def test_should_page_backward_by_ordering_keys(items):
+    names, page_info = execute_keyset_query(last=2)
+    assert names == ["item 4", "item 5"]
+    assert page_info["hasPreviousPage"] is True
+    assert page_info["hasNextPage"] is False
+
+    names, page_info = execute_keyset_query(last=2, before=page_info["startCursor"])
+    assert names == ["item 2", "item 3"]
+    assert page_info["hasPreviousPage"] is True
+    assert page_info["hasNextPage"] is True
+
+
+@pytest.mark.django_db
+def test_should_filter_pages_without_offsets(items):
+    _, page_info = execute_keyset_query(first=3)
+    with CaptureQueriesContext(connection) as queries:
+        execute_keyset_query(first=2, after=page_info["endCursor"])
+    assert len(queries) == 1
+    sql = queries[0]["sql"]
+    assert "OFFSET" not in sql
+    assert "LIMIT 3" in sql
+    # The optimizer only loads the selected columns, and the key columns
+    # are loaded even if they are not selected.
+    assert '"tests_item"."parent_id"' not in sql
+    assert '"tests_item"."name"' in sql
+    assert '"tests_item"."value"' in sql
+
+
+@pytest.mark.django_db
+def test_should_reject_invalid_keyset_cursors(items):
+    result = schema.execute(KEYSET_QUERY, variables={"first": 2, "after": "foo"})
+    assert result.errors
+    assert "Invalid keyset cursor" in str(result.errors[0])
+
+
+def test_should_add_primary_key_to_keyset_keys():
+    assert get_keyset_keys(Item.objects.order_by("-value")) == [
+        ("value", True),
+        ("id", False),
+    ]
+    assert get_keyset_keys(Item.objects.order_by("-pk")) == [("id", True)]
+    with pytest.raises(ValueError):
+        get_keyset_keys(Item.objects.order_by("parent__name"))
+
+
+def test_should_reject_nullable_keyset_keys():
+    with pytest.raises(ValueError, match="non-nullable"):
+        get_keyset_keys(Item.objects.order_by("parent"))
+
+
+@pytest.mark.django_db
+def test_should_prefetch_relations_of_keyset_pages(items):
+    document = """
+        query {
+            keysetItems(first: 3) {
+                edges {
+                    node {
+                        name
+                        children {
+                            name
+                        }
+                    }
+                }
+            }
+        }
+    """
+    execution = assert_max_queries(schema, document, 2)
+    assert "LIMIT 4" in execution.queries[0]
@@ -0,0 +1,132 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.persisted import check_plans, compile_plans, main
+from graphene_django_optimizer.query import QueryOptimizer
+from graphene_django_optimizer.testing import (
+    assert_plan_equals,
+    create_resolve_info,
+    execute_query,
+)
+
+from .models import Item
+from .schema import schema
+
+ITEMS_QUERY = """
+    query Items {
+        items(name: "foo") {
+            id
+            father {
+                id
+                name
+            }
+        }
+        relayItems(first: 10) {
+            edges {
+                node {
+                    id
+                    children {
+                        name
+                    }
+                }
+            }
+        }
+    }
+"""
+
+# Neither the filtered prefetch queryset nor the plan that depends on the
+# variables can be compiled.
+FILTERED_QUERY = """
+    query Filtered($filters: ItemFilterInput) {
+        items(name: "foo") {
+            filteredChildren(name: "bar") {
+                id
+            }
+        }
+        relayItems {
+            edges {
+                node {
+                    childrenCustomFiltered(filterInput: $filters) {
+                        edges {
+                            node {
+                                id
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+"""
+
+
+def get_compiled_data(*documents):
+    return json.loads(json.dumps(compile_plans(schema, documents)))
+
+
+def test_should_compile_plans_that_only_depend_on_the_document():
+    data = get_compiled_data(ITEMS_QUERY, FILTERED_QUERY)
+    assert sorted(key.split(":", 1)[1] for key in data["plans"]) == [
+        "Items:items",
+        "Items:relayItems",
+    ]
+    assert check_plans(data, schema) == []
+
+
+@pytest.mark.django_db
+def test_should_use_compiled_plans_instead_of_the_selections(monkeypatch):
+    parent = Item.objects.create(name="foo")
+    Item.objects.create(name="bar", parent=parent)
+    expected = execute_query(schema, ITEMS_QUERY)
+
+    plans = gql_optimizer.CompiledPlans.load(get_compiled_data(ITEMS_QUERY), schema)
+    info = create_resolve_info(schema, ITEMS_QUERY)
+    qs = Item.objects.filter(name="foo")
+    assert_plan_equals(
+        QueryOptimizer(info, compiled_plans=plans).optimize(qs),
+        gql_optimizer.query(qs, info),
+    )
+
+    def walk(*args):
+        raise AssertionError("The selections were walked")
+
+    monkeypatch.setattr(QueryOptimizer, "_optimize_gql_selections", walk)
+    context = SimpleNamespace(gql_optimizer_compiled_plans=plans)
+    execution = execute_query(schema, ITEMS_QUERY, context_value=context)
+    assert not execution.result.errors
+    assert execution.result.data == expected.result.data
+    assert execution.queries == expected.queries
+
+
+def test_should_ignore_plans_that_do_not_match_the_schema(caplog):
+    data = get_compiled_data(ITEMS_QUERY)
+    data["schema"] = "0" * 64
+    next(iter(data["plans"].values()))["model"] = "tests.MissingItem"
+    assert check_plans(data, schema) == [
+        "the schema changed",
+        "the model tests.MissingItem doesn't exist",
+    ]
+    plans = gql_optimizer.CompiledPlans.load(data, schema)
+    assert plans.plans == {}
+    assert "The compiled plans are ignored" in caplog.text
+
+
+def test_should_compile_and_check_plans_from_the_command_line(tmp_path, capsys):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"items": ITEMS_QUERY}))
+    output = tmp_path / "plans.json"
+    assert (
+        main(["compile-plans", "tests.schema.schema", str(manifest), "-o", str(output)])
+        == 0
+    )
+    assert "2 plan(s) compiled from 1 document(s)" in capsys.readouterr().err
+    assert main(["check-plans", "tests.schema.schema", str(output)]) == 0
+
+    data = json.loads(output.read_text())
+    data["schema"] = "0" * 64
+    output.write_text(json.dumps(data))
+    assert main(["check-plans", "tests.schema.schema", str(output)]) == 1
+    assert "the schema changed" in capsys.readouterr().out
@@ -0,0 +1,115 @@
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.profiling import INSTANCES, OPTIMIZE, PREFETCH
+
+from .models import Item
+from .schema import schema
+
+CHILDREN_QUERY = """
+    query Children {
+        relayItems {
+            edges {
+                node {
+                    id
+                    children {
+                        id
+                        name
+                    }
+                }
+            }
+        }
+    }
+"""
+
+
+@pytest.fixture
+def items():
+    parent = Item.objects.create(name="foo")
+    parent.children.create(name="bar")
+
+
+@pytest.mark.django_db
+def test_should_report_memory_of_optimization_rows_and_prefetches(items):
+    reports = []
+    profiler = gql_optimizer.MemoryProfiler(reports.append)
+    context = SimpleNamespace(gql_optimizer_memory_profiler=profiler)
+    result = schema.execute(CHILDREN_QUERY, context_value=context)
+    assert not result.errors
+    sections = [(report.path, report.kind) for report in reports]
+    assert ("relayItems", OPTIMIZE) in sections
+    assert ("relayItems", INSTANCES) in sections
+    assert ("relayItems.children", PREFETCH) in sections
+    for report in reports:
+        assert report.operation == "Children"
+        assert report.peak >= 0
+        assert len(report.top_stats) <= 10
+    assert not tracemalloc.is_tracing()
+
+
+@pytest.mark.django_db
+def test_should_only_profile_sampled_calls(items):
+    reports = []
+    profiler = gql_optimizer.MemoryProfiler(reports.append, sample_rate=0)
+    context = SimpleNamespace(gql_optimizer_memory_profiler=profiler)
+    result = schema.execute(CHILDREN_QUERY, context_value=context)
+    assert not result.errors
+    assert reports == []
+
+
+def test_should_measure_overlapping_sections():
+    reports = []
+    profiler = gql_optimizer.MemoryProfiler(reports.append)
+    info = SimpleNamespace(operation=SimpleNamespace(name=None))
+    first = profiler.trace(info, INSTANCES, "first")
+    second = profiler.trace(info, INSTANCES, "second")
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert tracemalloc.is_tracing()
+    second.__exit__(None, None, None)
+    assert [report.path for report in reports] == ["first", "second"]
+    assert not tracemalloc.is_tracing()
+
+
+@pytest.mark.django_db
+def test_should_profile_prefetches_optimized_by_their_hint(items):
+    reports = []
+    profiler = gql_optimizer.MemoryProfiler(reports.append, snapshot_limit=0)
+    context = SimpleNamespace(gql_optimizer_memory_profiler=profiler)
+    result = schema.execute(
+        """
+        query {
+            items(name: "foo") {
+                id
+                auxFilteredChildren(name: "bar") {
+                    id
+                }
+            }
+        }
+    """,
+        context_value=context,
+    )
+    assert not result.errors
+    sections = [(report.path, report.kind) for report in reports]
+    assert ("items.gql_filtered_children_bar", PREFETCH) in sections
+
+
+@pytest.mark.django_db
+def test_should_not_profile_querysets_read_by_iterator(items):
+    reports = []
+    profiler = gql_optimizer.MemoryProfiler(reports.append, snapshot_limit=0)
+    info = SimpleNamespace(operation=SimpleNamespace(name=None))
+    qs = profiler.attach(Item.objects.order_by("id"), info, "items")
+    instances = qs.iterator()
+    assert next(instances).name == "foo"
+    assert not tracemalloc.is_tracing()
+    assert [item.name for item in instances] == ["bar"]
+    assert reports == []
+
+    assert [item.name for item in qs] == ["foo", "bar"]
+    assert [report.path for report in reports] == ["items"]
+    assert not tracemalloc.is_tracing()
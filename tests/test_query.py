@@ -1,14 +1,25 @@
+import sys
+from copy import copy
+
 import pytest
+from graphql.language.ast import OperationType
+from graphql_relay import to_global_id
+from mock import patch
 
 from django.test.utils import CaptureQueriesContext
-from django.db import connection
+from django.db import connection, connections
 from django.db.models import Prefetch
+from django.db.models.constants import LOOKUP_SEP
 import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.query import QueryOptimizer
+from graphene_django_optimizer.testing import assert_max_queries
 
 from .graphql_utils import create_resolve_info
 from .models import (
     Item,
     OtherItem,
+    RankedItem,
+    RelatedItem,
     RelatedOneToManyItem,
 )
 from .schema import schema
@@ -28,6 +39,7 @@ def test_should_reduce_number_of_queries_by_using_select_related():
                 foo
                 parent {
                     id
+                    name
                 }
             }
         }
@@ -165,6 +177,59 @@ def test_should_try_to_optimize_non_field_model_fields_when_disabling_abort_only
     assert_query_equality(items, optimized_items)
 
 
+@pytest.mark.django_db
+def test_should_not_join_related_objects_of_which_only_the_id_is_selected():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "bar") {
+                id
+                parent {
+                    id
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="bar")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id", "parent")
+    assert_query_equality(items, optimized_items)
+    assert items._iterable_class.stub_lookups == ("parent",)
+
+
+@pytest.mark.django_db
+def test_should_resolve_related_objects_of_which_only_the_id_is_selected():
+    parent = Item.objects.create(name="foo")
+    Item.objects.create(name="bar", parent=parent)
+    with CaptureQueriesContext(connection) as context:
+        result = schema.execute(
+            """
+            query {
+                relayItems {
+                    edges {
+                        node {
+                            name
+                            parent {
+                                id
+                            }
+                        }
+                    }
+                }
+            }
+        """
+        )
+    assert not result.errors
+    assert result.data["relayItems"]["edges"][1]["node"] == {
+        "name": "bar",
+        "parent": {"id": to_global_id("ItemType", parent.pk)},
+    }
+    # The count and the items, without joining nor querying the parents.
+    assert len(context.captured_queries) == 2
+    assert " JOIN " not in context.captured_queries[1]["sql"]
+
+
 @pytest.mark.django_db
 def test_should_optimize_when_using_fragments():
     # parent = Item.objects.create(name='foo')
@@ -181,13 +246,16 @@ def test_should_optimize_when_using_fragments():
             id
             parent {
                 id
+                name
             }
         }
     """,
     )
     qs = Item.objects.filter(name="bar")
     items = gql_optimizer.query(qs, info)
-    optimized_items = qs.select_related("parent").only("id", "parent__id")
+    optimized_items = qs.select_related("parent").only(
+        "id", "parent__id", "parent__name"
+    )
     assert_query_equality(items, optimized_items)
 
 
@@ -232,6 +300,7 @@ def test_should_select_nested_related_fields():
                     id
                     parent {
                         id
+                        name
                     }
                 }
             }
@@ -291,6 +360,7 @@ def test_should_prefetch_nested_select_related_field():
                     foo
                     item {
                         id
+                        name
                     }
                 }
             }
@@ -354,6 +424,7 @@ def test_should_select_nested_prefetch_and_select_related_fields():
                         foo
                         item {
                             id
+                            name
                         }
                     }
                 }
@@ -381,6 +452,7 @@ def test_should_fetch_fields_of_related_field():
                 id
                 parent {
                     id
+                    name
                 }
             }
         }
@@ -388,7 +460,9 @@ def test_should_fetch_fields_of_related_field():
     )
     qs = Item.objects.filter(name="bar")
     items = gql_optimizer.query(qs, info)
-    optimized_items = qs.select_related("parent").only("id", "parent__id")
+    optimized_items = qs.select_related("parent").only(
+        "id", "parent__id", "parent__name"
+    )
     assert_query_equality(items, optimized_items)
 
 
@@ -616,3 +690,592 @@ def test_should_accept_two_hints_with_same_prefetch_to_attr_and_keep_one_of_them
         )
     )
     assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_scope_only_abort_to_the_related_model():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            otherItems {
+                id
+                someOtherItem {
+                    id
+                    foo
+                }
+            }
+        }
+    """,
+    )
+    qs = OtherItem.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.select_related("some_other_item").only(
+        "id", "some_other_item__id", "some_other_item__name"
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_defer_unselected_columns_of_related_models_when_only_is_aborted():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                foo
+                ... on DetailedInterface {
+                    detail
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.select_related("detaileditem").defer("detaileditem__item_type")
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+@patch.dict("graphene_django_optimizer.registry._heavy_fields", {Item: {"name"}})
+def test_should_defer_heavy_fields_when_only_is_aborted():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                foo
+                parent {
+                    id
+                    foo
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.select_related("parent").defer("name")
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_infer_dependencies_of_model_properties():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                parentName
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.select_related("parent").only(
+        "id", "parent_id", "parent__name"
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_infer_related_manager_returned_by_model_methods():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                allChildren {
+                    id
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch("children", queryset=Item.objects.only("id", "parent_id")),
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db(databases=["default", "replica"])
+def test_should_pin_generated_querysets_to_the_given_database():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                children {
+                    id
+                    otmItems {
+                        id
+                    }
+                }
+            }
+        }
+    """,
+    )
+    Item.objects.create(name="foo")
+    parent = Item.objects.using("replica").create(name="foo")
+    child = Item.objects.using("replica").create(name="bar", parent=parent)
+    RelatedOneToManyItem.objects.using("replica").create(name="baz", item=child)
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info, database="replica")
+    assert items.db == "replica"
+    (children_prefetch,) = items._prefetch_related_lookups
+    assert children_prefetch.queryset.db == "replica"
+    (otm_items_prefetch,) = children_prefetch.queryset._prefetch_related_lookups
+    assert otm_items_prefetch.queryset.db == "replica"
+    # The rows, and the rows of the prefetches, are read from the replica.
+    with CaptureQueriesContext(connections["replica"]) as queries:
+        (item,) = items
+        (item_child,) = item.children.all()
+        (otm_item,) = item_child.otm_items.all()
+    assert len(queries) == 3
+    assert item.pk == parent.pk
+    assert otm_item.name == "baz"
+
+
+@pytest.mark.django_db(databases=["default", "replica"])
+def test_should_read_the_database_from_the_request_context():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+            }
+        }
+    """,
+    )
+    context = type("Context", (), {"gql_optimizer_database": "replica"})()
+    info = info._replace(context=context)
+    Item.objects.using("replica").create(name="foo")
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    assert items.db == "replica"
+    assert items.count() == 1
+    assert Item.objects.filter(name="foo").count() == 0
+
+
+@pytest.mark.django_db(databases=["default", "replica"])
+def test_should_use_the_database_for_writes_in_mutations():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                children {
+                    id
+                }
+            }
+        }
+    """,
+    )
+    operation = copy(info.operation)
+    operation.operation = OperationType.MUTATION
+    info = info._replace(operation=operation)
+    parent = Item.objects.create(name="foo")
+    Item.objects.create(name="bar", parent=parent)
+    Item.objects.using("replica").create(name="foo")
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info, database="replica")
+    assert items.db == "default"
+    (children_prefetch,) = items._prefetch_related_lookups
+    assert children_prefetch.queryset.db == "default"
+    (item,) = items
+    assert item.pk == parent.pk
+    assert [child.name for child in item.children.all()] == ["bar"]
+
+
+def _get_stack_depth():
+    frame = sys._getframe()
+    depth = 0
+    while frame:
+        frame = frame.f_back
+        depth += 1
+    return depth
+
+
+@pytest.mark.django_db
+def test_should_optimize_deeply_nested_selections_without_recursion():
+    depth = 100
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                %s name id %s
+            }
+        }
+    """
+        % ("parent {" * depth, "}" * depth),
+    )
+    optimizer = QueryOptimizer(info)
+    field_type = info.return_type.of_type
+    recursion_limit = sys.getrecursionlimit()
+    # Far less than the frames needed to walk one level per frame.
+    # Django itself needs recursion to apply the plan, so only the walk
+    # is checked.
+    sys.setrecursionlimit(_get_stack_depth() + depth // 2)
+    try:
+        store = optimizer._optimize_gql_selections(field_type, info.field_nodes[0])
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    lookup = LOOKUP_SEP.join(["parent"] * depth)
+    plan = store.flatten(Item)
+    assert plan.select_list == [lookup]
+    assert plan.only_list[-1] == lookup + LOOKUP_SEP + "id"
+
+
+@pytest.mark.django_db
+@patch.object(QueryOptimizer, "_create_resolve_info")
+def test_should_not_create_resolve_info_for_hints_that_do_not_read_it(
+    create_resolve_info_mock,
+):
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                auxChildrenNames
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related("children")
+    assert_query_equality(items, optimized_items)
+    assert create_resolve_info_mock.call_count == 0
+
+
+@pytest.mark.django_db
+def test_should_not_modify_the_plan_when_applying_it():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                parent {
+                    id
+                    filteredChildren(name: "bar") {
+                        id
+                    }
+                }
+            }
+        }
+    """,
+    )
+    optimizer = QueryOptimizer(info)
+    store = optimizer._optimize_gql_selections(
+        info.return_type.of_type, info.field_nodes[0]
+    )
+    qs = Item.objects.filter(name="foo")
+    items = store.optimize_queryset(qs)
+    assert_query_equality(items, store.optimize_queryset(qs))
+    (prefetch,) = items._prefetch_related_lookups
+    assert prefetch.prefetch_to == "parent__gql_filtered_children_bar"
+    (hint_prefetch,) = store.select_stores["parent"].prefetch_list
+    assert hint_prefetch.prefetch_to == "gql_filtered_children_bar"
+
+
+@pytest.mark.django_db
+def test_should_merge_the_selections_of_all_the_field_nodes():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+            }
+            items(name: "foo") {
+                children {
+                    id
+                }
+            }
+        }
+    """,
+    )
+    assert len(info.field_nodes) == 2
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch("children", queryset=Item.objects.only("id", "parent_id")),
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_merge_repeated_selections_of_a_field():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                children {
+                    id
+                }
+                children {
+                    name
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch("children", queryset=Item.objects.only("id", "name", "parent_id")),
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_only_fetch_primary_keys_for_typename_only_selections():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                __typename
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id")
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_load_every_column_for_unoptimized_fields_without_abort_only():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                unoptimizedTitle
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info, disable_abort_only=True)
+    assert_query_equality(items, qs)
+
+
+@pytest.mark.django_db
+def test_should_remove_the_ordering_of_unordered_prefetches():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items {
+                unorderedOtmItems {
+                    id
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.prefetch_related(
+        Prefetch(
+            "otm_items",
+            queryset=RelatedOneToManyItem.objects.order_by().only("id", "item_id"),
+            to_attr="gql_ordered_unorderedOtmItems",
+        ),
+    )
+    assert_query_equality(items, optimized_items)
+    assert "ORDER BY" not in str(items._prefetch_related_lookups[0].queryset.query)
+    assert items._prefetch_related_lookups[0].to_attr == (
+        "gql_ordered_unorderedOtmItems"
+    )
+
+
+@pytest.mark.django_db
+def test_should_order_prefetches_by_the_arguments_of_the_selection():
+    item = Item.objects.create(name="foo")
+    for name in ("b", "c", "a"):
+        RelatedOneToManyItem.objects.create(name=name, item=item)
+    document = """
+        query {
+            relayItems {
+                edges {
+                    node {
+                        sortedOtmItems(orderBy: "-name") {
+                            name
+                        }
+                    }
+                }
+            }
+        }
+    """
+    info = create_resolve_info(schema, document)
+    qs = Item.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.prefetch_related(
+        Prefetch(
+            "otm_items",
+            queryset=RelatedOneToManyItem.objects.order_by("-name").only(
+                "name", "item_id"
+            ),
+            to_attr="gql_ordered_sortedOtmItems",
+        ),
+    )
+    assert_query_equality(items, optimized_items)
+    assert items._prefetch_related_lookups[0].to_attr == "gql_ordered_sortedOtmItems"
+
+
+@pytest.mark.django_db
+def test_should_prefetch_each_ordering_of_a_relation_separately():
+    item = Item.objects.create(name="foo")
+    for name in ("b", "c", "a"):
+        RelatedOneToManyItem.objects.create(name=name, item=item)
+    result = schema.execute(
+        """
+        query {
+            relayItems {
+                edges {
+                    node {
+                        asc: sortedOtmItems(orderBy: "name") {
+                            name
+                        }
+                        desc: sortedOtmItems(orderBy: "-name") {
+                            name
+                        }
+                        plain: unorderedOtmItems {
+                            name
+                        }
+                    }
+                }
+            }
+        }
+    """
+    )
+    assert not result.errors
+    node = result.data["relayItems"]["edges"][0]["node"]
+    assert node["asc"] == [{"name": "a"}, {"name": "b"}, {"name": "c"}]
+    assert node["desc"] == [{"name": "c"}, {"name": "b"}, {"name": "a"}]
+    assert sorted(row["name"] for row in node["plain"]) == ["a", "b", "c"]
+
+
+@pytest.mark.django_db
+def test_should_not_prefetch_relations_with_an_invalid_ordering():
+    item = Item.objects.create(name="foo")
+    RelatedOneToManyItem.objects.create(name="a", item=item)
+    result = schema.execute(
+        """
+        query {
+            relayItems {
+                edges {
+                    node {
+                        name
+                        sortedOtmItems(orderBy: "missing") {
+                            name
+                        }
+                    }
+                }
+            }
+        }
+    """
+    )
+    assert result.data["relayItems"]["edges"][0]["node"] == {
+        "name": "foo",
+        "sortedOtmItems": None,
+    }
+    assert [error.path for error in result.errors] == [
+        ["relayItems", "edges", 0, "node", "sortedOtmItems"]
+    ]
+
+
+@pytest.mark.django_db
+def test_should_prefetch_the_rows_of_a_custom_through_model():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            relatedItems {
+                id
+                rankedItemRows {
+                    rank
+                    item {
+                        name
+                    }
+                }
+            }
+        }
+    """,
+    )
+    qs = RelatedItem.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch(
+            "rankings",
+            queryset=RankedItem.objects.select_related("item").only(
+                "rank", "related_item_id", "item__id", "item__name"
+            ),
+        ),
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_resolve_the_rows_of_a_custom_through_model_in_one_query():
+    related_item = RelatedItem.objects.create(name="foo")
+    for rank, name in enumerate(("bar", "baz")):
+        item = Item.objects.create(name=name)
+        RankedItem.objects.create(related_item=related_item, item=item, rank=rank)
+    document = """
+        query {
+            relayItems {
+                edges {
+                    node {
+                        id
+                        rankedByRows {
+                            rank
+                            relatedItem {
+                                name
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    """
+    info = create_resolve_info(schema, document)
+    qs = Item.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch(
+            "item_rankings",
+            queryset=RankedItem.objects.select_related("related_item").only(
+                "rank", "item_id", "related_item__item_ptr_id", "related_item__name"
+            ),
+        ),
+    )
+    assert_query_equality(items, optimized_items)
+
+    result = assert_max_queries(schema, document, 3).result
+    rows = [edge["node"]["rankedByRows"] for edge in result.data["relayItems"]["edges"]]
+    assert rows == [
+        [],
+        [{"rank": 0, "relatedItem": {"name": "foo"}}],
+        [{"rank": 1, "relatedItem": {"name": "foo"}}],
+    ]
@@ -0,0 +1,166 @@
+import pytest
+from django.db import connection
+from django.db.models import Prefetch
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.reference import (
+    get_reference_instance,
+    invalidate_reference_cache,
+)
+from graphene_django_optimizer.testing import assert_max_queries
+
+from .graphql_utils import create_resolve_info
+from .models import OtherItem, SomeOtherItem
+from .schema import schema
+from .test_utils import assert_query_equality
+
+
+@pytest.fixture
+def reference_model():
+    with patch("graphene_django_optimizer.registry._reference_models", set()):
+        gql_optimizer.register_reference_model(SomeOtherItem)
+        invalidate_reference_cache(SomeOtherItem)
+        yield SomeOtherItem
+    invalidate_reference_cache(SomeOtherItem)
+
+
+def _create_resolve_info():
+    return create_resolve_info(
+        schema,
+        """
+        query {
+            otherItems {
+                id
+                someOtherItem {
+                    id
+                    name
+                }
+            }
+        }
+    """,
+    )
+
+
+@pytest.mark.django_db
+def test_should_not_join_reference_models(reference_model):
+    qs = OtherItem.objects.all()
+    items = gql_optimizer.query(qs, _create_resolve_info())
+    optimized_items = qs.only("id", "some_other_item_id")
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_attach_reference_instances_from_the_cache(reference_model):
+    some_other_item = SomeOtherItem.objects.create(name="foo")
+    for i in range(3):
+        OtherItem.objects.create(name="bar", some_other_item=some_other_item)
+
+    qs = OtherItem.objects.all()
+    with CaptureQueriesContext(connection) as query_capture:
+        names = [
+            item.some_other_item.name
+            for item in gql_optimizer.query(qs, _create_resolve_info())
+        ]
+    assert names == ["foo", "foo", "foo"]
+    # One query for the items and one to load the reference table
+    assert len(query_capture.captured_queries) == 2
+
+    with CaptureQueriesContext(connection) as query_capture:
+        list(gql_optimizer.query(qs, _create_resolve_info()))
+    assert len(query_capture.captured_queries) == 1
+
+
+@pytest.mark.django_db
+def test_should_invalidate_the_cache_when_a_reference_instance_is_saved(
+    reference_model,
+):
+    some_other_item = SomeOtherItem.objects.create(name="foo")
+    OtherItem.objects.create(name="bar", some_other_item=some_other_item)
+    qs = OtherItem.objects.all()
+    (item,) = gql_optimizer.query(qs, _create_resolve_info())
+    assert item.some_other_item.name == "foo"
+
+    some_other_item.name = "foobar"
+    some_other_item.save()
+    (item,) = gql_optimizer.query(qs, _create_resolve_info())
+    assert item.some_other_item.name == "foobar"
+
+
+@pytest.mark.django_db
+def test_should_join_reference_models_with_selected_relations(reference_model):
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            otherItems {
+                id
+                someOtherItem {
+                    id
+                    otheritemSet {
+                        id
+                    }
+                }
+            }
+        }
+    """,
+    )
+    qs = OtherItem.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = (
+        qs.select_related("some_other_item")
+        .only("id", "some_other_item__id")
+        .prefetch_related(
+            Prefetch(
+                "some_other_item__otheritem_set",
+                queryset=OtherItem.objects.only("id", "some_other_item"),
+            ),
+        )
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_not_query_the_relations_of_reference_instances(reference_model):
+    some_other_item = SomeOtherItem.objects.create(name="foo")
+    for i in range(3):
+        OtherItem.objects.create(name="bar", some_other_item=some_other_item)
+
+    assert_max_queries(
+        schema,
+        """
+        query {
+            otherItems {
+                someOtherItem {
+                    otheritemSet {
+                        id
+                    }
+                }
+            }
+        }
+    """,
+        2,
+    )
+
+
+@pytest.mark.django_db(databases=["default", "replica"])
+def test_should_cache_reference_instances_per_database(reference_model):
+    SomeOtherItem.objects.create(name="foo")
+    some_other_item = SomeOtherItem.objects.using("replica").create(name="bar")
+    OtherItem.objects.using("replica").create(
+        name="baz", some_other_item=some_other_item
+    )
+    # Load the reference table of the default database first.
+    assert get_reference_instance(SomeOtherItem, "id", some_other_item.id).name == (
+        "foo"
+    )
+
+    qs = OtherItem.objects.using("replica")
+    (item,) = gql_optimizer.query(qs, _create_resolve_info())
+    assert item.some_other_item.name == "bar"
+
+    some_other_item.name = "foobar"
+    some_other_item.save(using="replica")
+    (item,) = gql_optimizer.query(qs, _create_resolve_info())
+    assert item.some_other_item.name == "foobar"
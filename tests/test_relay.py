@@ -1,4 +1,5 @@
 import pytest
+from django.db.models import Prefetch
 
 import graphene_django_optimizer as gql_optimizer
 
@@ -48,6 +49,7 @@ def test_should_reduce_number_of_queries_in_relay_schema_by_using_select_related
                         foo
                         parent {
                             id
+                            name
                         }
                     }
                 }
@@ -201,3 +203,118 @@ def test_should_resolve_nested_variables():
     assert len(child_edges) == 1
     assert child_edges["node"]["id"] == "SXRlbU5vZGU6OA=="
     assert child_edges["node"]["parentId"] == "SXRlbU5vZGU6Nw=="
+
+
+@pytest.mark.django_db
+def test_should_only_fetch_primary_keys_for_page_info_only_selections():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            relayItems {
+                pageInfo {
+                    hasNextPage
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.all()
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id")
+    assert_query_equality(items, optimized_items)
+
+    Item.objects.create(id=7, name="foo")
+    Item.objects.create(id=13, name="bar")
+    result = schema.execute(
+        """
+        query {
+            relayItems(first: 1) {
+                pageInfo {
+                    hasNextPage
+                }
+            }
+        }
+    """
+    )
+    assert not result.errors
+    assert result.data["relayItems"]["pageInfo"]["hasNextPage"] is True
+
+
+@pytest.mark.django_db
+def test_should_filter_nested_filter_connection_fields_in_prefetch():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            relayItems {
+                edges {
+                    node {
+                        id
+                        filteredRelayChildren(value_Gte: 5) {
+                            edges {
+                                node {
+                                    id
+                                    name
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch(
+            "children",
+            queryset=Item.objects.filter(value__gte=5).only("id", "name", "parent"),
+            to_attr="gql_filtered_filteredRelayChildren",
+        )
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_use_prefetched_rows_of_nested_filter_connection_fields(
+    django_assert_num_queries,
+):
+    items = [Item.objects.create(name="item {}".format(i)) for i in range(2)]
+    for item in items:
+        item.children.create(name="small", value=1)
+        item.children.create(name="big", value=10)
+    with django_assert_num_queries(4):
+        result = schema.execute(
+            """
+            query {
+                relayItems(first: 2) {
+                    edges {
+                        node {
+                            small: filteredRelayChildren(name: "small") {
+                                edges {
+                                    node {
+                                        name
+                                    }
+                                }
+                            }
+                            big: filteredRelayChildren(value_Gte: 5) {
+                                edges {
+                                    node {
+                                        name
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        """
+        )
+    assert not result.errors
+    for edge in result.data["relayItems"]["edges"]:
+        small = edge["node"]["small"]["edges"]
+        big = edge["node"]["big"]["edges"]
+        assert [child["node"]["name"] for child in small] == ["small"]
+        assert [child["node"]["name"] for child in big] == ["big"]
@@ -1,7 +1,10 @@
+import mock
 import pytest
 
 from django.db.models import Prefetch
 import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.hints import OptimizationHints
+from graphene_django_optimizer.query import _LazyResolveInfo
 
 from .graphql_utils import create_resolve_info
 from .models import Item
@@ -194,3 +197,149 @@ def test_should_return_valid_result_with_prefetch_related_as_a_function_using_va
     assert (
         result.data["items"][0]["filteredChildren"][0]["parentId"] == "SXRlbVR5cGU6MQ=="
     )
+
+
+@pytest.mark.django_db
+def test_should_reuse_the_result_of_pure_hints():
+    query = """
+        query {
+            items(name: "foo") {
+                filteredChildren(name: "bar") {
+                    id
+                }
+            }
+        }
+    """
+    prefetch_children = mock.Mock(
+        side_effect=lambda info, name: Prefetch(
+            "children",
+            queryset=Item.objects.filter(name=name),
+            to_attr="gql_filtered_children_" + name,
+        )
+    )
+    optimization_hints = OptimizationHints(
+        prefetch_related=prefetch_children,
+        pure=True,
+    )
+    info = create_resolve_info(schema, query)
+    field_info = info._replace(field_nodes=info.field_nodes[0].selection_set.selections)
+
+    first_prefetch = optimization_hints.prefetch_related(field_info, "bar")
+    second_prefetch = optimization_hints.prefetch_related(field_info, "bar")
+    assert prefetch_children.call_count == 1
+    assert first_prefetch is not second_prefetch
+    assert first_prefetch.queryset is not second_prefetch.queryset
+    assert str(first_prefetch.queryset.query) == str(second_prefetch.queryset.query)
+
+    optimization_hints.prefetch_related(field_info, "foobar")
+    assert prefetch_children.call_count == 2
+
+
+@pytest.mark.django_db
+def test_should_optimize_queryset_of_optimized_prefetch_with_the_selection():
+    info = create_resolve_info(
+        schema,
+        """
+        query {
+            items(name: "foo") {
+                id
+                childrenWithMinValue(gte: 11) {
+                    id
+                    name
+                    parent {
+                        id
+                        name
+                    }
+                }
+            }
+        }
+    """,
+    )
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info)
+    optimized_items = qs.only("id").prefetch_related(
+        Prefetch(
+            "children",
+            queryset=Item.objects.filter(value__gte=11)
+            .select_related("parent")
+            .only("id", "name", "parent__id", "parent__name"),
+            to_attr="gql_children_with_min_value_11",
+        ),
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_return_valid_result_with_optimized_prefetch():
+    parent = Item.objects.create(name="foo")
+    Item.objects.create(name="bar", value=11, parent=parent)
+    Item.objects.create(name="foobar", value=5, parent=parent)
+    result = schema.execute(
+        """
+        query {
+            items(name: "foo") {
+                childrenWithMinValue(gte: 11) {
+                    name
+                }
+            }
+        }
+    """
+    )
+    assert not result.errors
+    assert result.data == {"items": [{"childrenWithMinValue": [{"name": "bar"}]}]}
+
+
+@pytest.mark.django_db
+def test_should_not_create_the_resolve_info_to_reuse_pure_hints():
+    query = """
+        query {
+            items(name: "foo") {
+                filteredChildren(name: "bar") {
+                    id
+                }
+            }
+        }
+    """
+    optimization_hints = OptimizationHints(
+        prefetch_related=lambda info, name: Prefetch(
+            "children",
+            queryset=Item.objects.filter(name=name),
+            to_attr="gql_filtered_children_" + name,
+        ),
+        pure=True,
+    )
+    info = create_resolve_info(schema, query)
+    factory = mock.Mock()
+    field_info = _LazyResolveInfo(
+        factory,
+        info.field_nodes[0].selection_set.selections,
+        info.fragments,
+        info.variable_values,
+    )
+    optimization_hints.prefetch_related(field_info, "bar")
+    optimization_hints.prefetch_related(field_info, "bar")
+    assert factory.call_count == 0
+
+
+@pytest.mark.django_db
+def test_should_reject_pure_hints_that_return_optimized_querysets():
+    query = """
+        query {
+            items(name: "foo") {
+                filteredChildren(name: "bar") {
+                    id
+                }
+            }
+        }
+    """
+    optimization_hints = OptimizationHints(
+        prefetch_related=lambda info, name: Prefetch(
+            "children",
+            queryset=gql_optimizer.query(Item.objects.filter(name=name), info),
+            to_attr="gql_filtered_children_" + name,
+        ),
+        pure=True,
+    )
+    info = create_resolve_info(schema, query)
+    with pytest.raises(ValueError, match="Pure hints can't return querysets"):
+        optimization_hints.prefetch_related(info, "bar")
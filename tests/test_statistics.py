@@ -0,0 +1,81 @@
+import pytest
+from django.db.models import Prefetch
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.statistics import JOIN, PREFETCH
+
+from .graphql_utils import create_resolve_info
+from .models import Item
+from .schema import schema
+from .test_utils import assert_query_equality
+
+PARENT_QUERY = """
+    query {
+        items(name: "foo") {
+            id
+            parent {
+                id
+                name
+            }
+        }
+    }
+"""
+
+
+@pytest.mark.django_db
+def test_should_join_foreign_keys_without_statistics():
+    statistics = gql_optimizer.PlannerStatistics()
+    info = create_resolve_info(schema, PARENT_QUERY)
+    qs = Item.objects.filter(name="foo")
+    items = gql_optimizer.query(qs, info, statistics=statistics)
+    optimized_items = qs.select_related("parent").only(
+        "id", "parent__id", "parent__name"
+    )
+    assert_query_equality(items, optimized_items)
+
+
+@pytest.mark.django_db
+def test_should_prefetch_foreign_keys_with_high_fan_out(django_assert_num_queries):
+    statistics = gql_optimizer.PlannerStatistics(prefetch_fan_out=2, min_rows=4)
+    parent = Item.objects.create(name="parent")
+    for _ in range(4):
+        Item.objects.create(name="foo", parent=parent)
+    info = create_resolve_info(schema, PARENT_QUERY)
+    qs = Item.objects.filter(name="foo")
+
+    items = list(gql_optimizer.query(qs, info, statistics=statistics))
+    assert statistics.get_counts(Item._meta.get_field("parent")) == (4, 1)
+    assert items[0].parent.name == "parent"
+
+    items = gql_optimizer.query(qs, info, statistics=statistics)
+    optimized_items = qs.prefetch_related(
+        Prefetch("parent", queryset=Item.objects.only("id", "name")),
+    ).only("id", "parent_id")
+    assert_query_equality(items, optimized_items)
+    with django_assert_num_queries(2):
+        assert [item.parent.name for item in items] == ["parent"] * 4
+
+
+@pytest.mark.django_db
+def test_should_keep_joining_foreign_keys_with_low_fan_out():
+    statistics = gql_optimizer.PlannerStatistics(prefetch_fan_out=2, min_rows=4)
+    for i in range(4):
+        parent = Item.objects.create(name="parent {}".format(i))
+        Item.objects.create(name="foo", parent=parent)
+    info = create_resolve_info(schema, PARENT_QUERY)
+    qs = Item.objects.filter(name="foo")
+
+    list(gql_optimizer.query(qs, info, statistics=statistics))
+    parent_field = Item._meta.get_field("parent")
+    assert statistics.get_counts(parent_field) == (4, 4)
+    assert statistics.get_strategy(parent_field) == JOIN
+
+
+def test_should_use_overridden_strategies():
+    statistics = gql_optimizer.PlannerStatistics()
+    statistics.override(Item, "parent", PREFETCH)
+    assert statistics.get_strategy(Item._meta.get_field("parent")) == PREFETCH
+    statistics.override(Item, "parent", None)
+    assert statistics.get_strategy(Item._meta.get_field("parent")) == JOIN
+    with pytest.raises(ValueError):
+        statistics.override(Item, "parent", "foo")
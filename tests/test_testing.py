@@ -0,0 +1,91 @@
+import pytest
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.query import QueryOptimizer
+from graphene_django_optimizer.testing import (
+    assert_constant_queries,
+    assert_max_queries,
+    assert_no_only_abort,
+    assert_plan_equals,
+    create_resolve_info,
+    execute_query,
+)
+
+from .models import Item
+from .schema import schema
+
+CHILDREN_QUERY = """
+    query {
+        relayItems {
+            edges {
+                node {
+                    id
+                    children {
+                        id
+                        name
+                    }
+                }
+            }
+        }
+    }
+"""
+
+
+def create_items(size):
+    for i in range(size):
+        parent = Item.objects.create(name="parent{}".format(i))
+        parent.children.create(name="child{}".format(i))
+
+
+@pytest.mark.django_db
+def test_should_return_executed_queries():
+    create_items(2)
+    execution = execute_query(schema, CHILDREN_QUERY)
+    assert not execution.result.errors
+    assert len(execution.queries) == 3
+    assert "tests_item" in execution.queries[0]
+
+
+@pytest.mark.django_db
+def test_should_fail_when_there_are_more_queries_than_expected():
+    create_items(2)
+    assert_max_queries(schema, CHILDREN_QUERY, 3)
+    with pytest.raises(AssertionError, match="Expected at most 2 queries, 3 were"):
+        assert_max_queries(schema, CHILDREN_QUERY, 2)
+
+
+@pytest.mark.django_db
+def test_should_fail_when_queries_grow_with_rows(monkeypatch):
+    assert assert_constant_queries(schema, CHILDREN_QUERY, create_items) == {
+        1: 3,
+        10: 3,
+    }
+    assert not Item.objects.exists()
+
+    monkeypatch.setattr(QueryOptimizer, "optimize", lambda s, q: q)
+    with pytest.raises(AssertionError, match="grows with the number of rows"):
+        assert_constant_queries(schema, CHILDREN_QUERY, create_items)
+
+
+def test_should_compare_plans():
+    info = create_resolve_info(schema, CHILDREN_QUERY)
+    qs = gql_optimizer.query(Item.objects.all(), info)
+    assert_plan_equals(qs, gql_optimizer.query(Item.objects.all(), info))
+    with pytest.raises(AssertionError):
+        assert_plan_equals(qs, Item.objects.only("id"))
+
+
+def test_should_report_paths_that_abort_only_optimization():
+    assert_no_only_abort(schema, CHILDREN_QUERY)
+    with pytest.raises(AssertionError, match="aborted for: <root>"):
+        assert_no_only_abort(
+            schema,
+            """
+            query {
+                items(name: "foo") {
+                    id
+                    unoptimizedTitle
+                }
+            }
+            """,
+        )
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from django.db.models import Prefetch
+from django.db.models.query import ModelIterable
+
+import graphene_django_optimizer as gql_optimizer
+from graphene_django_optimizer.testing import create_resolve_info
+
+from .models import Item
+from .schema import schema
+
+CHILDREN_QUERY = """
+    query Children {
+        relayItems {
+            edges {
+                node {
+                    id
+                    children {
+                        id
+                        name
+                    }
+                }
+            }
+        }
+    }
+"""
+
+
+class RecordingSpan(object):
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class RecordingTracer(object):
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        span = RecordingSpan(name, attributes or {})
+        self.spans.append(span)
+        yield span
+
+
+@pytest.mark.django_db
+def test_should_trace_the_sql_of_querysets_and_prefetches_with_their_path():
+    parent = Item.objects.create(name="foo")
+    parent.children.create(name="bar")
+    parent.children.create(name="baz")
+    tracer = RecordingTracer()
+    context = SimpleNamespace(
+        gql_optimizer_query_tracer=gql_optimizer.QueryTracer(tracer)
+    )
+    result = schema.execute(CHILDREN_QUERY, context_value=context)
+    assert not result.errors
+
+    spans = {span.attributes["graphql.path"]: span for span in tracer.spans}
+    assert sorted(spans) == ["relayItems", "relayItems.children"]
+    items_span = spans["relayItems"]
+    assert items_span.name == "SELECT tests_item"
+    assert items_span.attributes["graphql.operation.name"] == "Children"
+    assert items_span.attributes["db.system"] == "sqlite"
+    assert items_span.attributes["db.response.returned_rows"] == 3
+    assert items_span.attributes["db.duration_ms"] >= 0
+    children_span = spans["relayItems.children"]
+    assert children_span.attributes["db.response.returned_rows"] == 2
+    assert '"tests_item"."parent_id" IN' in children_span.attributes["db.statement"]
+
+
+@pytest.mark.django_db
+def test_should_trace_querysets_when_they_are_evaluated():
+    Item.objects.create(name="foo")
+    tracer = RecordingTracer()
+    info = create_resolve_info(schema, CHILDREN_QUERY)
+    items = gql_optimizer.query(
+        Item.objects.all(), info, query_tracer=gql_optimizer.QueryTracer(tracer)
+    )
+    assert tracer.spans == []
+    assert [item.name for item in items.filter(name="foo")] == ["foo"]
+    paths = [span.attributes["graphql.path"] for span in tracer.spans]
+    assert paths == ["relayItems", "relayItems.children"]
+    assert "WHERE" in tracer.spans[0].attributes["db.statement"]
+
+
+@pytest.mark.django_db
+def test_should_trace_prefetch_querysets_optimized_by_their_hint():
+    Item.objects.create(name="foo")
+    tracer = RecordingTracer()
+    document = """
+        query {
+            items(name: "foo") {
+                id
+                auxFilteredChildren(name: "bar") {
+                    id
+                }
+            }
+        }
+    """
+    context = SimpleNamespace(
+        gql_optimizer_query_tracer=gql_optimizer.QueryTracer(tracer)
+    )
+    result = schema.execute(document, context_value=context)
+    assert not result.errors
+    paths = [span.attributes["graphql.path"] for span in tracer.spans]
+    assert paths == ["items", "items.gql_filtered_children_bar"]
+
+
+@pytest.mark.django_db
+def test_should_not_modify_the_prefetches_of_the_queryset():
+    Item.objects.create(name="foo")
+    prefetch = Prefetch("children", queryset=Item.objects.all())
+    tracer = RecordingTracer()
+    items = gql_optimizer.QueryTracer(tracer).attach(
+        Item.objects.prefetch_related(prefetch),
+        create_resolve_info(schema, CHILDREN_QUERY),
+    )
+    assert len(list(items)) == 1
+    assert len(tracer.spans) == 2
+    assert prefetch.queryset._iterable_class is ModelIterable
+
+
+@pytest.mark.django_db
+def test_should_only_record_the_statements_of_the_traced_queryset():
+    Item.objects.create(name="foo")
+    Item.objects.create(name="bar")
+    tracer = RecordingTracer()
+    info = SimpleNamespace(operation=SimpleNamespace(name=None))
+    qs = gql_optimizer.QueryTracer(tracer).attach(
+        Item.objects.order_by("id"), info, "items"
+    )
+    names = []
+    for item in qs.iterator():
+        # Queries run while reading the instances aren't part of the span.
+        names.append((item.name, Item.objects.count()))
+    assert names == [("foo", 2), ("bar", 2)]
+    (span,) = tracer.spans
+    assert span.attributes["db.statement"].count("SELECT") == 1
+    assert span.attributes["db.response.returned_rows"] == 2